@@ -0,0 +1,255 @@
+"""Offline benchmarks of the pipeline that replay the saved test inputs, optionally
+scaled up by generators. Run from the repository root with:
+
+    python -m benchmarks.benchmark [-sc acled_100x,fts_10x] [-c <commit>]
+
+Results are saved by commit in benchmarks/results so that they can be compared with
+those of another commit using --compare.
+"""
+import argparse
+import json
+import platform
+import subprocess
+import sys
+from os import makedirs
+from os.path import exists, join
+from shutil import copytree
+
+from hdx.api.configuration import Configuration
+from hdx.utilities.dateparse import now_utc, parse_date
+from hdx.utilities.easy_logging import setup_logging
+from hdx.utilities.errors_onexit import ErrorsOnExit
+from hdx.utilities.path import temp_dir
+from hdx.utilities.useragent import UserAgent
+from scrapers.main import get_indicators
+from scrapers.outputs.base import BaseOutput
+from scrapers.outputs.dispatcher import OutputDispatcher
+from scrapers.outputs.json import JsonFile
+from scrapers.utilities.httpcache import CachedRead
+from scrapers.utilities.instrumentation import RunMetrics
+
+from .generators import scenarios
+
+fixtures_folder = join("tests", "fixtures", "input")
+today = parse_date("2022-09-05")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-sc",
+        "--scenarios",
+        default=None,
+        help=f"Scenarios to run from {','.join(scenarios)}",
+    )
+    parser.add_argument(
+        "-r", "--repeat", default=3, type=int, help="Runs of each scenario"
+    )
+    parser.add_argument(
+        "-c", "--compare", default=None, help="Commit to compare results with"
+    )
+    parser.add_argument(
+        "-t",
+        "--threshold",
+        default=1.2,
+        type=float,
+        help="Ratio of timings above which a slowdown is a regression",
+    )
+    parser.add_argument(
+        "-rf",
+        "--results_folder",
+        default=join("benchmarks", "results"),
+        help="Folder for results",
+    )
+    return parser.parse_args()
+
+
+def get_commit():
+    commit = subprocess.run(
+        ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True
+    ).stdout.strip()
+    status = subprocess.run(
+        ["git", "status", "--porcelain", "--untracked-files=no"],
+        capture_output=True,
+        text=True,
+    ).stdout
+    if status:
+        commit = f"{commit}-dirty"
+    return commit
+
+
+def get_configuration(overrides):
+    Configuration._create(
+        hdx_read_only=True,
+        hdx_site="prod",
+        project_config_yaml=join("config", "project_configuration.yml"),
+    )
+    configuration = Configuration.read()
+    for key, value in overrides.items():
+        configuration[key].update(value)
+    return configuration
+
+
+def run_pipeline(input_folder, temp_folder, overrides):
+    """Run get_indicators on saved inputs returning the timings of the whole
+    pipeline, each scraper and each output"""
+    configuration = get_configuration(overrides)
+    metrics = RunMetrics()
+    CachedRead.create_readers(
+        temp_folder,
+        input_folder,
+        temp_folder,
+        save=False,
+        use_saved=True,
+        today=today,
+        metrics=metrics,
+        parse_workers=configuration["parse_workers"],
+    )
+    tabs = configuration["tabs"]
+    noout = BaseOutput(tabs)
+    jsonout = JsonFile(configuration["json"], tabs)
+    with ErrorsOnExit() as errors_on_exit:
+        outputs = OutputDispatcher(
+            {"gsheets": noout, "excel": noout, "json": jsonout},
+            errors_on_exit=errors_on_exit,
+            metrics=metrics,
+            **configuration["outputs"],
+        )
+        countries_to_save = get_indicators(
+            configuration,
+            today,
+            outputs,
+            tabs,
+            errors_on_exit=errors_on_exit,
+            use_live=False,
+            metrics=metrics,
+        )
+        outputs["json"].save(folder=temp_folder, countries_to_save=countries_to_save)
+        outputs.close()
+    CachedRead.parse_pool.close()
+    report = metrics.get_report()
+    return {
+        "seconds": report["seconds"],
+        "maxrss_delta_kb": report["maxrss_delta_kb"],
+        "scrapers": {
+            name: record["seconds"] for name, record in report["scrapers"].items()
+        },
+        "outputs": {
+            name: record["seconds"] for name, record in report["outputs"].items()
+        },
+    }
+
+
+def run_scenario(name, repeat):
+    """Generate the inputs for a scenario and run the pipeline on them repeat times
+    returning the fastest run"""
+    scenario = scenarios[name]
+    with temp_dir(f"HornAfricaBenchmark{name}") as temp_folder:
+        input_folder = join(temp_folder, "input")
+        copytree(fixtures_folder, input_folder)
+        for generator, kwargs in scenario["generators"].items():
+            generator(input_folder, **kwargs)
+        results = list()
+        for i in range(repeat):
+            result = run_pipeline(input_folder, temp_folder, scenario["configuration"])
+            print(f"{name} run {i + 1}: {result['seconds']:.2f}s")
+            results.append(result)
+    return min(results, key=lambda x: x["seconds"])
+
+
+def load_results(results_folder, commit):
+    path = join(results_folder, f"{commit}.json")
+    if not exists(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_results(results_folder, commit, results):
+    makedirs(results_folder, exist_ok=True)
+    path = join(results_folder, f"{commit}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    return path
+
+
+def compare(old, new, threshold):
+    """Print timings of new results against old ones returning whether any scenario
+    as a whole has regressed by more than threshold"""
+    regressed = False
+
+    def compare_timing(name, old_seconds, new_seconds, noise=0.05):
+        if old_seconds is None:
+            print(f"{name}: {new_seconds:.3f}s (new)")
+            return False
+        ratio = new_seconds / old_seconds if old_seconds else 1
+        # Very short timings vary too much between runs to flag
+        is_regression = ratio > threshold and new_seconds - old_seconds > noise
+        flag = " REGRESSION" if is_regression else ""
+        print(f"{name}: {old_seconds:.3f}s -> {new_seconds:.3f}s ({ratio:.2f}x){flag}")
+        return is_regression
+
+    for scenario, result in new["scenarios"].items():
+        old_result = old["scenarios"].get(scenario)
+        if old_result is None:
+            print(f"{scenario}: {result['seconds']:.3f}s (new)")
+            continue
+        if compare_timing(scenario, old_result["seconds"], result["seconds"]):
+            regressed = True
+        for section in ("scrapers", "outputs"):
+            for name, seconds in result[section].items():
+                old_seconds = old_result[section].get(name)
+                compare_timing(f"  {name}", old_seconds, seconds)
+    return regressed
+
+
+def main(scenario_names, repeat, compare_commit, threshold, results_folder):
+    UserAgent.set_global("hdx-scraper-hornafrica-viz-benchmark")
+    commit = get_commit()
+    old = None
+    if compare_commit:
+        # Loaded up front in case it is the commit whose results are overwritten
+        old = load_results(results_folder, compare_commit)
+        if old is None:
+            print(f"No results for {compare_commit} in {results_folder}!")
+            return 1
+    results = load_results(results_folder, commit) or {"scenarios": dict()}
+    results.update(
+        {
+            "commit": commit,
+            "date": now_utc().isoformat(),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+        }
+    )
+    new = {"scenarios": dict()}
+    for name in scenario_names:
+        result = run_scenario(name, repeat)
+        results["scenarios"][name] = result
+        new["scenarios"][name] = result
+    path = save_results(results_folder, commit, results)
+    print(f"Saved results for {commit} in {path}")
+    if not old:
+        return 0
+    print(f"Comparing {compare_commit} with {commit}")
+    if compare(old, new, threshold):
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    setup_logging(console_log_level="WARNING")
+    args = parse_args()
+    if args.scenarios:
+        scenario_names = args.scenarios.split(",")
+    else:
+        scenario_names = list(scenarios.keys())
+    sys.exit(
+        main(
+            scenario_names,
+            args.repeat,
+            args.compare,
+            args.threshold,
+            args.results_folder,
+        )
+    )
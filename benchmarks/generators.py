@@ -0,0 +1,94 @@
+import csv
+import json
+import logging
+from glob import glob
+from os import remove
+from os.path import basename, exists, join
+from shutil import copyfile
+
+logger = logging.getLogger(__name__)
+
+
+def scale_acled(folder, factor=1, years=1, latest_year=2022, page_size=5000):
+    """Scale the saved ACLED files in folder so that there are factor times as many
+    events in each of years years ending with latest_year, split into pages of
+    page_size events as downloaded. Copies of events get new ids and events for
+    earlier years are shifted back a whole number of years. Returns the number of
+    events written."""
+    no_events = 0
+    for path in glob(join(folder, f"acled_*-year-{latest_year}-page-1.csv")):
+        with open(path, encoding="utf-8", newline="") as f:
+            rows = list(csv.DictReader(f))
+        if not rows:
+            continue
+        fieldnames = list(rows[0].keys())
+        remove(path)
+        for year in range(latest_year - years + 1, latest_year + 1):
+            events = list()
+            for copy in range(factor):
+                for row in rows:
+                    row = dict(row)
+                    if copy:
+                        row["event_id_cnty"] = f"{row['event_id_cnty']}-{copy}"
+                    row["event_date"] = f"{year}{row['event_date'][4:]}"
+                    events.append(row)
+            no_events += len(events)
+            # A full last page is followed by an empty one
+            for page, start in enumerate(range(0, len(events) + 1, page_size)):
+                filename = basename(path).replace(
+                    f"-year-{latest_year}-page-1", f"-year-{year}-page-{page + 1}"
+                )
+                with open(
+                    join(folder, filename), "w", encoding="utf-8", newline=""
+                ) as f:
+                    writer = csv.DictWriter(f, fieldnames)
+                    writer.writeheader()
+                    writer.writerows(events[start : start + page_size])
+    logger.info(f"Generated {no_events} ACLED events")
+    return no_events
+
+
+def scale_fts(folder, factor=1, year=2022):
+    """Scale the saved FTS plans in folder so that there are factor times as many.
+    Copies of plans get new ids and their location breakdowns are copied so that
+    they are fetched and processed like the originals. Returns the number of plans
+    written."""
+    path = join(folder, f"fts_progress-{year}.json")
+    with open(path, encoding="utf-8") as f:
+        progress = json.load(f)
+    plans = progress["data"]["plans"]
+    location_path = join(folder, "fts_flow-custom-search-planid-%d-groupby-location.json")
+    new_plans = list()
+    for copy in range(1, factor):
+        for plan in plans:
+            plan_id = plan["id"] + copy * 100000
+            new_plans.append(dict(plan, id=plan_id))
+            # Only multi-country plans have a location breakdown
+            if exists(location_path % plan["id"]):
+                copyfile(location_path % plan["id"], location_path % plan_id)
+    plans.extend(new_plans)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(progress, f)
+    logger.info(f"Generated {len(plans)} FTS plans")
+    return len(plans)
+
+
+# Each scenario is a mapping from generator to its keyword arguments along with any
+# changes to the configuration needed to read what is generated. Only Ethiopia,
+# Kenya and Somalia have saved inputs and admin units so scaling up countries is
+# approximated by scaling up events for the countries there are.
+scenarios = {
+    "fixtures": {"generators": {}, "configuration": {}},
+    "acled_100x": {
+        "generators": {scale_acled: {"factor": 100}},
+        "configuration": {},
+    },
+    "acled_10_years_10x": {
+        "generators": {scale_acled: {"factor": 10, "years": 10}},
+        "configuration": {"acled": {"start_date": "2013-01-01"}},
+    },
+    "fts_10x": {
+        "generators": {scale_fts: {"factor": 10}},
+        "configuration": {},
+    },
+}
@@ -1,21 +1,22 @@
 import argparse
 import logging
 from os import getenv
-from os.path import join, expanduser
+from os.path import join, expanduser, splitext
 
 from hdx.api.configuration import Configuration
 from hdx.facades.keyword_arguments import facade
-from hdx.scraper.outputs.base import BaseOutput
-from hdx.scraper.outputs.excelfile import ExcelFile
-from hdx.scraper.outputs.googlesheets import GoogleSheets
-from hdx.scraper.outputs.json import JsonFile
 from hdx.scraper.utilities import string_params_to_dict
-from hdx.scraper.utilities.reader import Read
 from hdx.utilities.dateparse import now_utc
 from hdx.utilities.easy_logging import setup_logging
 from hdx.utilities.errors_onexit import ErrorsOnExit
 from hdx.utilities.path import temp_dir
 from scrapers.main import get_indicators
+from scrapers.outputs.base import BaseOutput
+from scrapers.outputs.dispatcher import OutputDispatcher
+from scrapers.outputs.json import JsonFile
+from scrapers.utilities.httpcache import CachedRead, HTTPCache
+from scrapers.utilities.instrumentation import RunMetrics
+from scrapers.utilities.profiles import check_profiles, get_profile_configuration
 
 setup_logging()
 logger = logging.getLogger()
@@ -43,6 +44,13 @@ def parse_args():
         default=None,
         help="Spreadsheets to update",
     )
+    parser.add_argument(
+        "-gd",
+        "--gsheet_diff",
+        default=False,
+        action="store_true",
+        help="Only send changed rows to Google Sheets",
+    )
     parser.add_argument("-sc", "--scrapers", default=None, help="Scrapers to run")
     parser.add_argument("-ut", "--updatetabs", default=None, help="Sheets to update")
     parser.add_argument(
@@ -52,6 +60,13 @@ def parse_args():
         action="store_true",
         help="Do not update json",
     )
+    parser.add_argument(
+        "-cj",
+        "--compact_json",
+        default=False,
+        action="store_true",
+        help="Save json in compact format",
+    )
     parser.add_argument(
         "-ha",
         "--header_auths",
@@ -87,13 +102,128 @@ def parse_args():
         action="store_true",
         help="Use saved data",
     )
+    parser.add_argument(
+        "-cf",
+        "--cache_folder",
+        default=None,
+        help="Trusted folder for data kept between runs",
+    )
+    parser.add_argument(
+        "-ar",
+        "--acled_rebuild",
+        default=False,
+        action="store_true",
+        help="Rebuild stored ACLED events from scratch",
+    )
+    parser.add_argument(
+        "-su",
+        "--skip_unchanged",
+        default=False,
+        action="store_true",
+        help="Reuse values of scrapers whose inputs are unchanged",
+    )
+    parser.add_argument(
+        "-rr",
+        "--run_report",
+        default=None,
+        help="Path for JSON report of timings and counts",
+    )
+    parser.add_argument(
+        "-pt",
+        "--prometheus_textfile",
+        default=None,
+        help="Path for Prometheus textfile of timings and counts",
+    )
+    parser.add_argument(
+        "-pf",
+        "--profiles",
+        default=None,
+        help="Profiles (eg. regions) to run one after another sharing downloads",
+    )
     args = parser.parse_args()
     return args
 
 
+def run_profile(
+    configuration,
+    today,
+    excel_path,
+    gsheet_auth,
+    gsheet_diff,
+    updatesheets,
+    updatetabs,
+    scrapers_to_run,
+    nojson,
+    compact_json,
+    countries_override,
+    errors_on_exit,
+    cache_folder,
+    acled_rebuild,
+    skip_unchanged,
+    metrics,
+):
+    tabs = configuration["tabs"]
+    if updatetabs is None:
+        updatetabs = list(tabs.keys())
+    noout = BaseOutput(updatetabs)
+    # Output backends are only imported when used since their clients take a
+    # noticeable time to import
+    if excel_path:
+        from scrapers.outputs.excelfile import ExcelFile
+
+        excelout = ExcelFile(excel_path, tabs, updatetabs)
+    else:
+        excelout = noout
+    if gsheet_auth:
+        from scrapers.outputs.googlesheets import GoogleSheets
+
+        gsheets = GoogleSheets(
+            configuration["googlesheets"],
+            gsheet_auth,
+            updatesheets,
+            tabs,
+            updatetabs,
+            diff=gsheet_diff,
+            **configuration["googlesheets_diff"],
+        )
+    else:
+        gsheets = noout
+    if nojson:
+        jsonout = noout
+    else:
+        jsonout = JsonFile(configuration["json"], updatetabs, compact=compact_json)
+    outputs = OutputDispatcher(
+        {"gsheets": gsheets, "excel": excelout, "json": jsonout},
+        errors_on_exit=errors_on_exit,
+        metrics=metrics,
+        **configuration["outputs"],
+    )
+    try:
+        countries_to_save = get_indicators(
+            configuration,
+            today,
+            outputs,
+            updatetabs,
+            scrapers_to_run,
+            countries_override,
+            errors_on_exit,
+            cache_folder=cache_folder,
+            acled_rebuild=acled_rebuild,
+            skip_unchanged=skip_unchanged,
+            metrics=metrics,
+        )
+        outputs["json"].save(countries_to_save=countries_to_save)
+        outputs["excel"].save()
+        outputs["gsheets"].save()
+    finally:
+        # Wait for the output threads even if the run failed
+        outputs.close()
+
+
 def main(
     excel_path,
     gsheet_auth,
+    gsheet_diff,
     updatesheets,
     updatetabs,
     scrapers_to_run,
@@ -101,17 +231,35 @@ def main(
     basic_auths,
     param_auths,
     nojson,
+    compact_json,
     countries_override,
     save,
     use_saved,
+    cache_folder,
+    acled_rebuild,
+    skip_unchanged,
+    run_report=None,
+    prometheus_textfile=None,
+    profiles=None,
     **ignore,
 ):
     logger.info(f"##### {lookup} version {VERSION:.1f} ####")
     configuration = Configuration.read()
+    if profiles:
+        check_profiles(configuration, profiles, gsheet_auth)
     with ErrorsOnExit() as errors_on_exit:
         with temp_dir() as temp_folder:
             today = now_utc()
-            Read.create_readers(
+            if run_report or prometheus_textfile:
+                metrics = RunMetrics()
+            else:
+                metrics = None
+            http_cache = None
+            if cache_folder:
+                cache_configuration = dict(configuration["http_cache"])
+                folder = join(cache_folder, cache_configuration.pop("folder"))
+                http_cache = HTTPCache(folder, **cache_configuration)
+            CachedRead.create_readers(
                 temp_folder,
                 "saved_data",
                 temp_folder,
@@ -122,46 +270,80 @@ def main(
                 basic_auths=basic_auths,
                 param_auths=param_auths,
                 today=today,
+                http_cache=http_cache,
+                metrics=metrics,
+                share_downloads=bool(profiles),
+                parse_workers=configuration["parse_workers"],
             )
             if scrapers_to_run:
                 logger.info(f"Updating only scrapers: {scrapers_to_run}")
-            tabs = configuration["tabs"]
             if updatetabs is None:
-                updatetabs = list(tabs.keys())
                 logger.info("Updating all tabs")
             else:
                 logger.info(f"Updating only these tabs: {updatetabs}")
-            noout = BaseOutput(updatetabs)
-            if excel_path:
-                excelout = ExcelFile(excel_path, tabs, updatetabs)
-            else:
-                excelout = noout
-            if gsheet_auth:
-                gsheets = GoogleSheets(
-                    configuration["googlesheets"],
-                    gsheet_auth,
-                    updatesheets,
-                    tabs,
-                    updatetabs,
-                )
-            else:
-                gsheets = noout
-            if nojson:
-                jsonout = noout
-            else:
-                jsonout = JsonFile(configuration["json"], updatetabs)
-            outputs = {"gsheets": gsheets, "excel": excelout, "json": jsonout}
-            countries_to_save = get_indicators(
-                configuration,
-                today,
-                outputs,
-                updatetabs,
-                scrapers_to_run,
-                countries_override,
-                errors_on_exit,
-            )
-            jsonout.save(countries_to_save=countries_to_save)
-            excelout.save()
+            try:
+                if not profiles:
+                    run_profile(
+                        configuration,
+                        today,
+                        excel_path,
+                        gsheet_auth,
+                        gsheet_diff,
+                        updatesheets,
+                        updatetabs,
+                        scrapers_to_run,
+                        nojson,
+                        compact_json,
+                        countries_override,
+                        errors_on_exit,
+                        cache_folder,
+                        acled_rebuild,
+                        skip_unchanged,
+                        metrics,
+                    )
+                for profile in profiles or []:
+                    logger.info(f"Running profile {profile}")
+                    if excel_path:
+                        root, extension = splitext(excel_path)
+                        profile_excel_path = f"{root}_{profile}{extension}"
+                    else:
+                        profile_excel_path = None
+                    # Files like scraper snapshots and stored ACLED events depend on
+                    # the profile's countries so are kept apart, but the HTTP cache is
+                    # shared
+                    if cache_folder:
+                        profile_cache_folder = join(cache_folder, profile)
+                    else:
+                        profile_cache_folder = None
+                    if metrics:
+                        metrics.profile = profile
+                    run_profile(
+                        get_profile_configuration(configuration, profile),
+                        today,
+                        profile_excel_path,
+                        gsheet_auth,
+                        gsheet_diff,
+                        updatesheets,
+                        updatetabs,
+                        scrapers_to_run,
+                        nojson,
+                        compact_json,
+                        countries_override,
+                        errors_on_exit,
+                        profile_cache_folder,
+                        acled_rebuild,
+                        skip_unchanged,
+                        metrics,
+                    )
+            finally:
+                # Shut down the parse workers and keep what was cached and measured
+                # even if a profile failed
+                CachedRead.parse_pool.close()
+                if http_cache:
+                    http_cache.output_cache_stats()
+                    http_cache.save()
+                if metrics:
+                    metrics.save(run_report, prometheus_textfile, http_cache)
 
 
 if __name__ == "__main__":
@@ -205,6 +387,10 @@ if __name__ == "__main__":
         param_auths = string_params_to_dict(pa)
     else:
         param_auths = None
+    if args.profiles:
+        profiles = args.profiles.split(",")
+    else:
+        profiles = None
     if args.countries_override:
         countries_override = args.countries_override.split(",")
     else:
@@ -217,6 +403,7 @@ if __name__ == "__main__":
         project_config_yaml=join("config", "project_configuration.yml"),
         excel_path=args.excel_path,
         gsheet_auth=gsheet_auth,
+        gsheet_diff=args.gsheet_diff,
         updatesheets=updatesheets,
         updatetabs=updatetabs,
         scrapers_to_run=scrapers_to_run,
@@ -224,7 +411,14 @@ if __name__ == "__main__":
         basic_auths=basic_auths,
         param_auths=param_auths,
         nojson=args.nojson,
+        compact_json=args.compact_json,
         countries_override=countries_override,
         save=args.save,
         use_saved=args.use_saved,
+        cache_folder=args.cache_folder,
+        acled_rebuild=args.acled_rebuild,
+        skip_unchanged=args.skip_unchanged,
+        run_report=args.run_report,
+        prometheus_textfile=args.prometheus_textfile,
+        profiles=profiles,
     )
@@ -1,5 +1,9 @@
+import csv
 import logging
-from itertools import chain
+import re
+from datetime import timedelta
+from itertools import islice
+from urllib.parse import urlencode
 
 from hdx.location.country import Country
 from hdx.scraper.base_scraper import BaseScraper
@@ -7,6 +11,9 @@ from hdx.scraper.utilities.sources import Sources
 from hdx.utilities.dateparse import default_date, parse_date
 from hdx.utilities.downloader import Download
 
+from .outputs.chunks import update_tab_in_chunks
+from .utilities.parallel import clone_reader, map_threaded
+
 logger = logging.getLogger(__name__)
 
 hxltags = {
@@ -26,6 +33,98 @@ hxltags = {
     "fatalities": "#affected+killed",
 }
 
+# Fields requested from ACLED, which are those output other than the pcode that is
+# looked up plus the country code
+fields = ["iso", "event_id_cnty"] + [x for x in hxltags if x != "adm2_pcode"]
+rollup_hxltags = {
+    "country_code": "#country+code",
+    "adm2_pcode": "#adm2+code",
+    "event_type": "#event+type",
+    "month": "#date+month",
+    "fatalities": "#affected+killed",
+    "events": "#event+num",
+}
+iso_date = re.compile(r"\d{4}-\d{2}-\d{2}")
+
+
+def filter_dates(dates, start_date):
+    """Get whether each of dates is on or after start_date along with the latest of
+    those that are. Dates in ACLED's YYYY-MM-DD format are compared as strings and
+    only any others are parsed."""
+    start = start_date.strftime("%Y-%m-%d")
+    if start_date > parse_date(start):
+        # A date without a time is before a start date later in the same day
+        start = (start_date + timedelta(days=1)).strftime("%Y-%m-%d")
+    is_iso = [iso_date.fullmatch(date) is not None for date in dates]
+    keep = [
+        date >= start if fast else parse_date(date) >= start_date
+        for date, fast in zip(dates, is_iso)
+    ]
+    latest_iso = max(
+        (date for date, fast, kept in zip(dates, is_iso, keep) if fast and kept),
+        default=None,
+    )
+    latest_dates = [
+        parse_date(date)
+        for date, fast, kept in zip(dates, is_iso, keep)
+        if kept and not fast
+    ]
+    if latest_iso:
+        latest_dates.append(parse_date(latest_iso))
+    return keep, max(latest_dates, default=None)
+
+
+class FatalitiesRollup:
+    """Fatalities and numbers of events by country, admin 2 pcode, event type and
+    month, along with national and regional totals by event type and month, built
+    up an event at a time. National totals have no pcode and regional totals no
+    country either. Events without a pcode only count towards the totals.
+
+    Args:
+        countryiso3s (List[str]): Countries in the order in which to output them
+    """
+
+    date_index = list(hxltags).index("event_date")
+    event_type_index = list(hxltags).index("event_type")
+    pcode_index = list(hxltags).index("adm2_pcode")
+    fatalities_index = list(hxltags).index("fatalities")
+
+    def __init__(self, countryiso3s):
+        self.countries = {countryiso3: i for i, countryiso3 in enumerate(countryiso3s)}
+        self.totals = dict()
+
+    def add(self, countryiso3, row):
+        month = row[self.date_index][:7]
+        event_type = row[self.event_type_index]
+        fatalities = int(row[self.fatalities_index] or 0)
+        keys = [(None, None), (countryiso3, None)]
+        pcode = row[self.pcode_index]
+        if pcode:
+            keys.append((countryiso3, pcode))
+        for key in keys:
+            key = key + (event_type, month)
+            totals = self.totals.get(key)
+            if totals is None:
+                self.totals[key] = [fatalities, 1]
+            else:
+                totals[0] += fatalities
+                totals[1] += 1
+
+    def get_rows(self):
+        """Get the rollup as rows with headers and HXL hashtags with the regional
+        totals first then each country's totals followed by its admin 2 units"""
+
+        def sort_key(key):
+            countryiso3, pcode, event_type, month = key
+            if countryiso3 is None:
+                return -1, "", event_type, month
+            return self.countries[countryiso3], pcode or "", event_type, month
+
+        rows = [list(rollup_hxltags.keys()), list(rollup_hxltags.values())]
+        for key in sorted(self.totals, key=sort_key):
+            rows.append(list(key) + self.totals[key])
+        return rows
+
 
 class ACLED(BaseScraper):
     def __init__(
@@ -35,6 +134,7 @@ class ACLED(BaseScraper):
         countryiso3s,
         outputs,
         admintwo,
+        store=None,
     ):
         # ACLED outputs to its own tab "fatalities" so there are no headers
         super().__init__(
@@ -50,42 +150,205 @@ class ACLED(BaseScraper):
         self.countryiso3s = countryiso3s
         self.outputs = outputs
         self.admintwo = admintwo
+        self.store = store
+        self.latest_date = default_date
 
-    def run(self):
+    def get_from_date(self, countryiso3):
+        """Get the date from which events already in the store are refetched for a
+        country, which is some days before the latest of them in case of late
+        additions, or None if there are none"""
+        if not self.store:
+            return None
+        watermark = self.store.get_watermark(countryiso3)
+        if not watermark:
+            return None
+        return watermark - timedelta(days=self.datasetinfo.get("overlap_days", 0))
+
+    def get_backfill_date(self, countryiso3):
+        """Get the date from which events already in the store for a country were
+        ingested if that is after the start date, so that earlier events need to be
+        fetched, otherwise None"""
+        if not self.store:
+            return None
+        start_date = self.store.get_start_date(countryiso3)
+        if start_date and start_date > self.start_date:
+            return start_date
+        return None
+
+    def get_years(self, countryiso3):
         years = range(self.start_date.year, self.today.year + 1)
-        iterables = list()
+        from_date = self.get_from_date(countryiso3)
+        if not from_date:
+            return years
+        # Past years never change so only refetch from the year of the latest events
+        # already in the store along with any years before the earliest of them
+        backfill_date = self.get_backfill_date(countryiso3)
+        backfill_year = backfill_date.year if backfill_date else years[0] - 1
+        return [x for x in years if x <= backfill_year or x >= from_date.year]
+
+    def get_start_date(self, year, countryiso3):
+        """Get the date from which to download events for a country and year and
+        whether that is to refetch events already in the store"""
+        start_date = max(self.start_date, parse_date(f"{year}-01-01"))
+        backfill_date = self.get_backfill_date(countryiso3)
+        if backfill_date and year <= backfill_date.year:
+            # The whole year is replaced as it is missing events
+            return start_date, False
+        from_date = self.get_from_date(countryiso3)
+        if from_date and from_date > start_date:
+            return from_date, True
+        return start_date, False
+
+    def download_files(self, reader, year, countryiso3, start_date):
+        """Download the events for a country and year from start_date a page at a
+        time returning the paths of the pages"""
+        reader = clone_reader(reader)
+        countrycode = Country.get_m49_from_iso3(countryiso3)
+        end_date = min(self.today, parse_date(f"{year}-12-31"))
+        page_size = self.datasetinfo["page_size"]
+        paths = list()
+        page = 1
+        while True:
+            parameters = {
+                "iso": countrycode,
+                "event_date": f"{start_date:%Y-%m-%d}|{end_date:%Y-%m-%d}",
+                "event_date_where": "BETWEEN",
+                "fields": "|".join(fields),
+                "limit": page_size,
+                "page": page,
+            }
+            url = f"{self.datasetinfo['url']}?{urlencode(parameters)}"
+            filename = f"acled-read-iso-{countrycode}-year-{year}-page-{page}.csv"
+            path = reader.download_file(url, filename)
+            paths.append(path)
+            with open(path, encoding="utf-8", newline="") as f:
+                no_rows = sum(1 for _ in csv.reader(f)) - 1
+            if no_rows < page_size:
+                return paths
+            page += 1
+
+    def read_events(self, paths, start_date, latest_dates):
+        """Iterate over (event id, row) for the events in paths from start_date on
+        with event dates in YYYY-MM-DD format. Rows are read and filtered chunk_size
+        at a time and the latest event date in each chunk is appended to
+        latest_dates."""
+        chunk_size = self.datasetinfo.get("chunk_size", 10000)
+        countries = dict()
+        with Download() as downloader:
+            headers, iterator = downloader.get_tabular_rows(paths, dict_form=True)
+            while True:
+                inrows = list(islice(iterator, chunk_size))
+                if not inrows:
+                    return
+                keep, latest_date = filter_dates(
+                    [inrow["event_date"] for inrow in inrows], start_date
+                )
+                if latest_date:
+                    latest_dates.append(latest_date)
+                for inrow, kept in zip(inrows, keep):
+                    if not kept:
+                        continue
+                    # Dates are compared and grouped into months as strings later
+                    # on so any not in ACLED's usual format are normalised
+                    event_date = inrow["event_date"]
+                    if not iso_date.fullmatch(event_date):
+                        inrow["event_date"] = f"{parse_date(event_date):%Y-%m-%d}"
+                    yield inrow["event_id_cnty"], self.get_row(inrow, countries)
+
+    def get_row(self, inrow, countries):
+        """Get the output row for an event looking up its pcode. countries is a
+        mapping from M49 code to ISO3 code and admin level filled in as needed."""
+        m49 = inrow["iso"]
+        country = countries.get(m49)
+        if country is None:
+            iso3 = Country.get_iso3_from_m49(int(m49))
+            country = (iso3, self.admintwo.get_admin_level(iso3))
+            countries[m49] = country
+        iso3, admlevel = country
+        admname = inrow[f"admin{admlevel}"]
+        pcode = None
+        if admname:
+            pcode, _ = self.admintwo.get_pcode(iso3, admname)
+        inrow["adm2_pcode"] = pcode
+        return [inrow[header] for header in hxltags]
+
+    def update_store(self, to_download, paths):
+        for (year, countryiso3, start_date, is_refetch), pages in zip(
+            to_download, paths
+        ):
+            latest_dates = list()
+            events = self.read_events(pages, start_date, latest_dates)
+            # Only events from the start date are replaced when refetching
+            from_date = start_date.date() if is_refetch else None
+            self.store.replace_group(countryiso3, year, events, from_date)
+            self.store.update_watermark(countryiso3, max(latest_dates, default=None))
+        for countryiso3 in self.countryiso3s:
+            self.store.update_start_date(countryiso3, self.start_date)
+        self.store.save()
+        latest_date = self.store.get_latest_date(self.countryiso3s)
+        self.latest_date = latest_date or default_date
+
+    def iter_events(self, to_download, paths):
+        """Iterate over (country, event row)"""
+        if self.store:
+            self.update_store(to_download, paths)
+            # The store can hold events from before the start date
+            yield from self.store.get_rows(self.countryiso3s, self.start_date)
+            return
+        for (_, countryiso3, start_date, _), pages in zip(to_download, paths):
+            latest_dates = list()
+            for _, row in self.read_events(pages, start_date, latest_dates):
+                yield countryiso3, row
+            latest_date = max(latest_dates, default=None)
+            if latest_date and latest_date > self.latest_date:
+                self.latest_date = latest_date
+
+    def iter_rows(self, events, rollup):
+        """Iterate over the rows of the fatalities tab adding every event to the
+        rollup but only outputting those from the last raw_events_days days if set"""
+        yield list(hxltags.keys())
+        yield list(hxltags.values())
+        raw_events_days = self.datasetinfo.get("raw_events_days")
+        if raw_events_days is None:
+            from_date = ""
+        else:
+            from_date = f"{self.today - timedelta(days=raw_events_days):%Y-%m-%d}"
+        for countryiso3, row in events:
+            rollup.add(countryiso3, row)
+            if row[0] >= from_date:
+                yield row
+
+    def run(self):
         reader = self.get_reader()
-        for year in years:
+        to_download = list()
+        for year in range(self.start_date.year, self.today.year + 1):
             for countryiso3 in self.countryiso3s:
-                countrycode = Country.get_m49_from_iso3(countryiso3)
-                url = self.datasetinfo["url"] % (countrycode, year)
-                path = reader.download_file(url)
-                downloader = Download()
-                headers, iterator = downloader.get_tabular_rows(path, dict_form=True)
-                iterables.append(iterator)
-        latest_date = default_date
-        rows = [list(hxltags.keys()), list(hxltags.values())]
-        for inrow in chain.from_iterable(iterables):
-            date = parse_date(inrow["event_date"])
-            if date < self.start_date:
-                continue
-            if date > latest_date:
-                latest_date = date
-            iso3 = Country.get_iso3_from_m49(int(inrow["iso"]))
-            admlevel = self.admintwo.get_admin_level(iso3)
-            admname = inrow[f"admin{admlevel}"]
-            pcode = None
-            if admname:
-                pcode, _ = self.admintwo.get_pcode(iso3, admname)
-            inrow["adm2_pcode"] = pcode
-            row = list()
-            for header in hxltags:
-                row.append(inrow[header])
-            rows.append(row)
-        tabname = "fatalities"
+                if year in self.get_years(countryiso3):
+                    start_date, is_refetch = self.get_start_date(year, countryiso3)
+                    to_download.append((year, countryiso3, start_date, is_refetch))
+        paths = map_threaded(
+            lambda args: self.download_files(reader, *args[:3]),
+            to_download,
+            self.datasetinfo.get("max_workers", 1),
+        )
+        self.latest_date = default_date
+        rollup = FatalitiesRollup(self.countryiso3s)
+        rows = self.iter_rows(self.iter_events(to_download, paths), rollup)
+        if self.datasetinfo.get("raw_events_days") == 0:
+            for _ in rows:
+                pass
+        else:
+            # Rows are read, filtered, geocoded and written out a chunk at a time
+            update_tab_in_chunks(
+                self.outputs,
+                "fatalities",
+                rows,
+                self.datasetinfo.get("chunk_size", 10000),
+            )
+        rows = rollup.get_rows()
         for output in self.outputs.values():
-            output.update_tab(tabname, rows)
-        self.datasetinfo["source_date"] = latest_date
+            output.update_tab("fatalitiesrollup", rows)
+        self.datasetinfo["source_date"] = self.latest_date
 
     def add_sources(self):
         self.add_hxltag_source(
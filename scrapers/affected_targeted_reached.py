@@ -2,8 +2,10 @@ import logging
 
 from hdx.scraper.base_scraper import BaseScraper
 from hdx.scraper.utilities.sources import Sources
-from hdx.utilities.dictandlist import dict_of_lists_add
 from hdx.utilities.text import number_format
+from hxl.model import TagPattern
+
+from .utilities.parallel import clone_reader, map_threaded
 
 logger = logging.getLogger(__name__)
 
@@ -35,54 +37,80 @@ class AffectedTargetedReached(BaseScraper):
         self.admintwo = admintwo
         self.datasetinfos = dict()
 
+    @staticmethod
+    def get_column_indices(columns, hxltag):
+        pattern = TagPattern.parse(hxltag)
+        return [i for i, column in enumerate(columns) if pattern.match(column)]
+
+    def read_data(self, reader, countryiso3, dataset):
+        reader = clone_reader(reader)
+        datasetinfo = {"dataset": dataset, "format": "csv"}
+        resource = reader.read_hdx_metadata(datasetinfo)
+        data = reader.read_hxl_resource(
+            f"{self.name}-{countryiso3}", resource, self.name
+        )
+        return datasetinfo, data
+
     def run(self) -> None:
         datasets = self.datasetinfo["datasets"]
         reader = self.get_reader()
-        affecteddict = dict()
-        targeteddict = dict()
-        reacheddict = dict()
-        prioritydict = dict()
+        # Running (sum, count) for each indicator keyed by (country, pcode)
+        totals = tuple(dict() for _ in self.hxltags)
 
-        for countryiso3, dataset in datasets.items():
-            datasetinfo = {"dataset": dataset, "format": "csv"}
-            resource = reader.read_hdx_metadata(datasetinfo)
+        # Read concurrently but process in country order
+        max_workers = self.datasetinfo.get("max_workers", 1)
+        reader.read_datasets(datasets.values(), max_workers)
+        results = map_threaded(
+            lambda item: self.read_data(reader, *item), datasets.items(), max_workers
+        )
+        for countryiso3, (datasetinfo, data) in zip(datasets, results):
             self.datasetinfos[countryiso3] = datasetinfo
-            data = reader.read_hxl_resource(
-                f"{self.name}-{countryiso3}", resource, self.name
-            )
             admin_level = self.admintwo.get_admin_level(countryiso3)
+            # Match columns to hashtags once rather than for every row. Like Row.get,
+            # the first non empty value of any matching column is used.
+            columns = data.columns
+            pcode_hxltag = f"#adm{admin_level}+code"
+            pcode_indices = self.get_column_indices(columns, pcode_hxltag)
+            indices = [self.get_column_indices(columns, x) for x in self.hxltags]
             for row in data:
-                pcode = row.get(f"#adm{admin_level}+code")
-
-                def add_to_dict(inddict, hxltag, pcode):
-                    value = row.get(hxltag)
-                    if value is not None:
-                        dict_of_lists_add(inddict, f"{countryiso3}:{pcode}", int(value))
-
-                add_to_dict(affecteddict, "#affected+total", pcode)
-                add_to_dict(targeteddict, "#targeted+total", pcode)
-                add_to_dict(reacheddict, "#reached+total", pcode)
-                add_to_dict(prioritydict, "#priority", pcode)
+                values = row.values
+                no_values = len(values)
+                pcode = None
+                for i in pcode_indices:
+                    if i < no_values and values[i]:
+                        pcode = values[i]
+                        break
+                key = (countryiso3, pcode)
+                for hxltag_indices, hxltag_totals in zip(indices, totals):
+                    for i in hxltag_indices:
+                        if i < no_values and values[i]:
+                            value = int(values[i])
+                            total = hxltag_totals.get(key)
+                            if total is None:
+                                hxltag_totals[key] = [value, 1]
+                            else:
+                                total[0] += value
+                                total[1] += 1
+                            break
 
-        def fill_values(input, output, adminlevel, average=False):
-            for countrypcode in input:
-                countryiso3, pcode = countrypcode.split(":")
-                if pcode not in adminlevel.pcodes:
-                    logger.error(f"PCode {pcode} in {countryiso3} does not exist!")
-                else:
-                    aggregate_value = sum(input[countrypcode])
-                    if average:
-                        aggregate_value /= len(input[countrypcode])
-                    output[pcode] = number_format(aggregate_value, format="%.0f")
+        keys = set()
+        for hxltag_totals in totals:
+            keys.update(hxltag_totals)
+        pcodes = set(self.admintwo.pcodes)
+        invalid_keys = {key for key in keys if key[1] not in pcodes}
+        for countryiso3, pcode in sorted(invalid_keys, key=str):
+            logger.error(f"PCode {pcode} in {countryiso3} does not exist!")
 
-        affected = self.get_values("admintwo")[0]
-        fill_values(affecteddict, affected, self.admintwo)
-        targeted = self.get_values("admintwo")[1]
-        fill_values(targeteddict, targeted, self.admintwo)
-        reached = self.get_values("admintwo")[2]
-        fill_values(reacheddict, reached, self.admintwo)
-        priority = self.get_values("admintwo")[3]
-        fill_values(prioritydict, priority, self.admintwo, average=True)
+        # Priority is averaged and the other indicators are summed
+        averages = (False, False, False, True)
+        output_values = self.get_values("admintwo")
+        for hxltag_totals, output, average in zip(totals, output_values, averages):
+            for key, (aggregate_value, count) in hxltag_totals.items():
+                if key in invalid_keys:
+                    continue
+                if average:
+                    aggregate_value /= count
+                output[key[1]] = number_format(aggregate_value, format="%.0f")
 
     def add_sources(self) -> None:
         for countryiso3, datasetinfo in self.datasetinfos.items():
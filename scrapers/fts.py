@@ -7,6 +7,8 @@ from hdx.scraper.base_scraper import BaseScraper
 from hdx.scraper.utilities.sources import Sources
 from hdx.utilities.text import get_fraction_str
 
+from .utilities.parallel import clone_reader, map_threaded
+
 logger = logging.getLogger(__name__)
 
 
@@ -15,7 +17,7 @@ class FTSException(Exception):
 
 
 class FTS(BaseScraper):
-    def __init__(self, datasetinfo, today, outputs, countryiso3s):
+    def __init__(self, datasetinfo, today, outputs, countryiso3s, cache=None):
         super().__init__(
             "fts",
             datasetinfo,
@@ -47,6 +49,7 @@ class FTS(BaseScraper):
         self.today = today
         self.outputs = outputs
         self.countryiso3s = countryiso3s
+        self.cache = cache
 
     def download(self, url, reader, **kwargs):
         json = reader.download_json(url, **kwargs)
@@ -58,13 +61,21 @@ class FTS(BaseScraper):
     def download_data(self, url, reader, **kwargs):
         return self.download(url, reader, **kwargs)["data"]
 
+    def get_plan_data(self, plan, kind, fetch):
+        if self.cache is None:
+            return fetch()
+        return self.cache.get_plan_data(plan, kind, fetch)
+
+    def get_location_data(self, base_url, plan, reader):
+        url = f"{base_url}1/fts/flow/custom-search?planid={plan['id']}&groupby=location"
+        return self.get_plan_data(
+            plan, "location", lambda: self.download_data(url, clone_reader(reader))
+        )
+
     def get_requirements_and_funding_location(
-        self, base_url, plan, countryid_iso3mapping, reader
+        self, plan_id, data, countryid_iso3mapping
     ):
         allreqs, allfunds = dict(), dict()
-        plan_id = plan["id"]
-        url = f"{base_url}1/fts/flow/custom-search?planid={plan_id}&groupby=location"
-        data = self.download_data(url, reader)
         requirements = data["requirements"]
         totalreq = requirements["totalRevisedReqs"]
         countryreq_is_totalreq = True
@@ -104,6 +115,28 @@ class FTS(BaseScraper):
                     allfunds[countryiso] = fundobj["totalFunding"]
         return allreqs, allfunds
 
+    def get_organisation_data(
+        self, base_url, year, countryiso, countryid, plan, reader
+    ):
+        reader = clone_reader(reader)
+        url = f"{base_url}1/fts/flow/custom-search?planid={plan['id']}&groupby=organization"
+        data = self.get_plan_data(
+            plan, "organization", lambda: self.download_data(url, reader)
+        )
+        fundingobjects = data["report1"]["fundingTotals"]["objects"]
+        if len(fundingobjects) == 0:
+            return fundingobjects, None
+        url = f"{base_url}2/country/{countryid}/summary/sourceOrganizations/{year}"
+
+        def fetch():
+            return self.download_data(
+                url, reader, filename=f"sourceorganizations_{countryiso.lower()}.json"
+            )["objects"]
+
+        if self.cache is None:
+            return fundingobjects, fetch()
+        return fundingobjects, self.cache.get_organisations(countryid, year, fetch)
+
     def run(self) -> None:
         (
             requirements_values,
@@ -136,6 +169,25 @@ class FTS(BaseScraper):
         url = f"{base_url}2/fts/flow/plan/overview/progress/{curdate.year}"
         data = self.download_data(url, reader)
         plans = data["plans"]
+        max_workers = self.datasetinfo.get("max_workers", 1)
+        # The location breakdowns of multi-country plans are fetched concurrently up
+        # front but plans are still chosen in order below
+        multicountry_plans = list()
+        for plan in plans:
+            if plan.get("customLocationCode") == "COVD":
+                continue
+            countryids = {str(x["id"]) for x in plan["countries"] if x["iso3"]}
+            if len(countryids) > 1:
+                multicountry_plans.append(plan)
+        location_data = map_threaded(
+            lambda plan: self.get_location_data(base_url, plan, reader),
+            multicountry_plans,
+            max_workers,
+        )
+        location_data = {
+            plan["id"]: data for plan, data in zip(multicountry_plans, location_data)
+        }
+        plans_by_id = {plan["id"]: plan for plan in plans}
         for plan in plans:
             allreq = plan["requirements"]["revisedRequirements"]
             funding = plan.get("funding")
@@ -178,7 +230,7 @@ class FTS(BaseScraper):
                         )
             else:
                 allreqs, allfunds = self.get_requirements_and_funding_location(
-                    base_url, plan, countryid_iso3mapping, reader
+                    plan_id, location_data[plan_id], countryid_iso3mapping
                 )
                 for countryiso in allfunds:
                     plantype_value = plantype_values.get(countryiso)
@@ -214,19 +266,25 @@ class FTS(BaseScraper):
             list(self.planfund_hxltags.keys()),
             list(self.planfund_hxltags.values()),
         ]
-        for countryiso, plan_id in chosen_plans.items():
-            url = f"{base_url}1/fts/flow/custom-search?planid={plan_id}&groupby=organization"
-            data = self.download_data(url, reader)
-            fundingobjects = data["report1"]["fundingTotals"]["objects"]
+        organisation_data = map_threaded(
+            lambda item: self.get_organisation_data(
+                base_url,
+                curdate.year,
+                item[0],
+                countryiso3_to_id[item[0]],
+                plans_by_id[item[1]],
+                reader,
+            ),
+            chosen_plans.items(),
+            max_workers,
+        )
+        for (countryiso, plan_id), (fundingobjects, orgs) in zip(
+            chosen_plans.items(), organisation_data
+        ):
             if len(fundingobjects) == 0:
                 continue
-            countryid = countryiso3_to_id[countryiso]
-            url = f"{base_url}2/country/{countryid}/summary/sourceOrganizations/{curdate.year}"
-            data = self.download_data(
-                url, reader, filename=f"sourceorganizations_{countryiso.lower()}.json"
-            )
             childorglookup = dict()
-            for org in data["objects"]:
+            for org in orgs:
                 childsorgs = org.get("childOrganizations")
                 if not childsorgs:
                     continue
@@ -256,15 +314,24 @@ class FTS(BaseScraper):
         tabname = "planorgfunding"
         for output in self.outputs.values():
             output.update_tab(tabname, planfund_output)
+        if self.cache:
+            self.cache.save()
 
     def add_sources(self) -> None:
         reader = self.get_reader()
         hxltags = self.get_headers("national")[1]
-        datasetinfo = None
+        dataset_names = dict()
         for countryiso3 in self.countryiso3s:
             countryname = Country.get_country_name_from_iso3(countryiso3).lower()
+            dataset_name = f"fts-requirements-and-funding-data-for-{countryname}"
+            dataset_names[countryiso3] = dataset_name
+        reader.read_datasets(
+            dataset_names.values(), self.datasetinfo.get("max_workers", 1)
+        )
+        datasetinfo = None
+        for countryiso3, dataset_name in dataset_names.items():
             datasetinfo = {
-                "dataset": f"fts-requirements-and-funding-data-for-{countryname}",
+                "dataset": dataset_name,
                 "source": self.datasetinfo["source"],
                 "format": "csv",
             }
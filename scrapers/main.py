@@ -1,17 +1,23 @@
 import logging
 from os.path import join
 
-from hdx.location.adminlevel import AdminLevel
-from hdx.location.country import Country
-from hdx.scraper.runner import Runner
-from hdx.scraper.utilities.fallbacks import Fallbacks
 from hdx.scraper.utilities.sources import Sources
 from hdx.scraper.utilities.writer import Writer
 
 from .acled import ACLED
 from .affected_targeted_reached import AffectedTargetedReached
 from .fts import FTS
+from .utilities.acled_store import ACLEDStore
+from .utilities.adminlevel import CachedAdminLevel
+from .utilities.configurable import CompiledRunner
+from .utilities.fallbacks import add_fallbacks
+from .utilities.fts_cache import FTSCache
+from .utilities.gazetteer import Gazetteer
+from .utilities.httpcache import CachedRead
+from .utilities.scheduler import Scheduler
+from .utilities.snapshots import ScraperSnapshots
 from .utilities.sources import custom_sources
+from .utilities.startup import StartupSnapshot
 
 logger = logging.getLogger(__name__)
 
@@ -26,24 +32,44 @@ def get_indicators(
     errors_on_exit=None,
     use_live=True,
     fallbacks_root="",
+    cache_folder=None,
+    acled_rebuild=False,
+    skip_unchanged=False,
+    metrics=None,
 ):
-    Country.countriesdata(
+    if cache_folder:
+        startup_configuration = dict(configuration["startup"])
+        snapshot_path = join(cache_folder, startup_configuration.pop("snapshot"))
+    else:
+        startup_configuration = dict()
+        snapshot_path = None
+    startup = StartupSnapshot(snapshot_path, **startup_configuration)
+    startup.setup_countries(
         use_live=use_live,
         country_name_overrides=configuration["country_name_overrides"],
         country_name_mappings=configuration["country_name_mappings"],
     )
+    startup.save()
 
     if countries_override:
         countries = countries_override
     else:
         countries = configuration["countries"]
     configuration["countries_fuzzy_try"] = countries
-    admintwo = AdminLevel(
-        configuration["admin2"],
-        admin_level=2,
-        admin_level_overrides={"ETH": 3, "KEN": 1},
+    admin_configuration = configuration["admin2"]
+    if cache_folder:
+        pcode_cache_path = join(cache_folder, configuration["pcode_cache"])
+        index_path = join(cache_folder, admin_configuration["index"])
+    else:
+        pcode_cache_path = None
+        index_path = None
+    admintwo = CachedAdminLevel(
+        admin_configuration,
+        admin_level=admin_configuration["admin_level"],
+        admin_level_overrides=admin_configuration["admin_level_overrides"],
+        cache_path=pcode_cache_path,
+        gazetteer=Gazetteer(admin_configuration["gazetteer"], index_path),
     )
-    admintwo.setup_from_admin_info(configuration["admin2"]["admin_info"])
     if fallbacks_root is not None:
         fallbacks_path = join(fallbacks_root, configuration["json"]["output"])
         levels_mapping = {
@@ -56,19 +82,24 @@ def get_indicators(
             "national": "#country+code",
             "admintwo": "#adm2+code",
         }
-        Fallbacks.add(
+        add_fallbacks(
             fallbacks_path,
             levels_mapping=levels_mapping,
             sources_key="sources_data",
             admin_name_mapping=admin_name_mapping,
         )
-    runner = Runner(
+    runner = CompiledRunner(
         countries,
         today,
         errors_on_exit=errors_on_exit,
         scrapers_to_run=scrapers_to_run,
     )
     configurable_scrapers = dict()
+    # Tables read by more than one scraper are only downloaded and parsed once
+    CachedRead.share_tables(
+        configuration[f"scraper_{level}"]
+        for level in ("regional", "national", "admintwo")
+    )
 
     def create_configurable_scrapers(level, suffix_attribute=None, adminlevel=None):
         suffix = f"_{level}"
@@ -87,17 +118,33 @@ def get_indicators(
     create_configurable_scrapers("national")
     create_configurable_scrapers("admintwo", adminlevel=admintwo)
 
-    fts = FTS(configuration["fts"], today, outputs, countries)
+    if cache_folder:
+        fts_configuration = configuration["fts"]
+        fts_cache = FTSCache(
+            join(cache_folder, fts_configuration["cache"]),
+            childorgs_ttl=fts_configuration["childorgs_ttl"],
+        )
+    else:
+        fts_cache = None
+    fts = FTS(configuration["fts"], today, outputs, countries, fts_cache)
     affectedtargetedreached = AffectedTargetedReached(
         configuration["affected_targeted_reached"], today, admintwo
     )
-    acled = ACLED(configuration["acled"], today, countries, outputs, admintwo)
+    if cache_folder:
+        acled_store = ACLEDStore(
+            join(cache_folder, configuration["acled"]["store"]), rebuild=acled_rebuild
+        )
+    else:
+        acled_store = None
+    acled = ACLED(
+        configuration["acled"], today, countries, outputs, admintwo, acled_store
+    )
 
     runner.add_customs((fts, affectedtargetedreached, acled))
     source_configuration = Sources.create_source_configuration(
         suffix_attribute="regional"
     )
-    runner.add_aggregators(
+    aggregator_names = runner.add_aggregators(
         True,
         configuration["aggregate_regional"],
         "national",
@@ -106,15 +153,50 @@ def get_indicators(
         source_configuration=source_configuration,
         force_add_to_run=True,
     )
-    runner.run(
-        prioritise_scrapers=(
-            "population_eth_national",
-            "population_ken_national",
-            "population_som_national",
-            "population_admintwo",
-            "population_regional",
+    population_names = (
+        "population_eth_national",
+        "population_ken_national",
+        "population_som_national",
+        "population_admintwo",
+    )
+    runner.prioritise_scrapers(population_names + ("population_regional",))
+    if skip_unchanged and cache_folder:
+        # Inputs are fetched again to check whether they have changed, which is
+        # only cheap from the HTTP cache or saved data
+        if CachedRead.http_cache is None and not CachedRead.get_reader().use_saved:
+            logger.warning(
+                "Not skipping unchanged scrapers as every input would have to be "
+                "downloaded again without the HTTP cache!"
+            )
+            skip_unchanged = False
+    if skip_unchanged and cache_folder:
+        skip_configuration = configuration["skip_unchanged"]
+        names = [
+            name
+            for name in runner.get_scraper_names()
+            if name not in aggregator_names
+            and name not in skip_configuration["exclude"]
+        ]
+        snapshots = ScraperSnapshots(
+            join(cache_folder, skip_configuration["snapshots"]), runner, names
+        )
+    else:
+        snapshots = None
+    scheduler = Scheduler(
+        runner, snapshots=snapshots, metrics=metrics, **configuration["scheduler"]
+    )
+    # Population is needed by other scrapers and the aggregators need the national
+    # values (and can use earlier aggregators) so run them one at a time
+    scheduler.run(
+        (
+            (population_names, None),
+            (("population_regional",), 1),
+            (None, None),
+            (aggregator_names, 1),
         )
     )
+    if snapshots:
+        snapshots.save()
 
     writer = Writer(runner, outputs)
     if "regional" in tabs:
@@ -130,6 +212,8 @@ def get_indicators(
     admintwo.output_matches()
     admintwo.output_ignored()
     admintwo.output_errors()
+    admintwo.output_cache_stats()
+    admintwo.save_cache()
 
     if "sources" in tabs:
         # sources = (
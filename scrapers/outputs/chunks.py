@@ -0,0 +1,30 @@
+from itertools import islice
+
+
+def update_tab_in_chunks(outputs, tabname, rows, chunk_size):
+    """Update tab in outputs from an iterable of rows where the first two rows are
+    the headers and HXL hashtags. Outputs that have an append_tab method receive the
+    rows a chunk at a time, while any others receive all the rows at the end."""
+    rows = iter(rows)
+    headers = [next(rows), next(rows)]
+    buffered = {
+        name: list(headers)
+        for name, output in outputs.items()
+        if not hasattr(output, "append_tab")
+    }
+    first_chunk = True
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk and not first_chunk:
+            break
+        for name, output in outputs.items():
+            values = buffered.get(name)
+            if values is not None:
+                values.extend(chunk)
+            elif first_chunk:
+                output.update_tab(tabname, headers + chunk)
+            else:
+                output.append_tab(tabname, headers + chunk)
+        first_chunk = False
+    for name, values in buffered.items():
+        outputs[name].update_tab(tabname, values)
@@ -0,0 +1,163 @@
+import logging
+from queue import Queue
+from threading import Thread
+from time import sleep
+from traceback import format_exc
+
+logger = logging.getLogger(__name__)
+
+
+class SinkWorker:
+    """Wraps an output so that calls to it are queued and made in order on its own
+    worker thread. The queue is bounded so that callers block if the output falls too
+    far behind. Calls that fail with connection errors or timeouts are retried with
+    backoff if making them again gives the same result, which by default is true of
+    update_tab and save. An output can set retry_methods to the methods for which
+    this is so. Appends are never retried since one that timed out may still have
+    been applied. If a call fails, the error is logged and added to errors_on_exit
+    and rows appended to the same tab are dropped until it is next updated, but
+    calls for other tabs are still made.
+
+    Args:
+        name (str): Name of output
+        output (BaseOutput): Output to wrap
+        queue_size (int): Maximum number of queued calls. Defaults to 16.
+        errors_on_exit (Optional[ErrorsOnExit]): ErrorsOnExit object. Defaults to None.
+        metrics (Optional[RunMetrics]): Metrics in which to record timings. Defaults to None.
+        max_retries (int): Maximum number of attempts for each call. Defaults to 3.
+        retry_wait (float): Seconds to wait before the first retry. Defaults to 1.
+    """
+
+    def __init__(
+        self,
+        name,
+        output,
+        queue_size=16,
+        errors_on_exit=None,
+        metrics=None,
+        max_retries=3,
+        retry_wait=1,
+    ):
+        self.name = name
+        self.output = output
+        self.queue = Queue(maxsize=queue_size)
+        self.errors_on_exit = errors_on_exit
+        self.metrics = metrics
+        self.max_retries = max_retries
+        self.retry_wait = retry_wait
+        self.retry_methods = getattr(output, "retry_methods", ("update_tab", "save"))
+        self.failed_tabs = set()
+        self.thread = Thread(target=self.work, name=f"output-{name}", daemon=True)
+        self.thread.start()
+
+    def work(self):
+        while True:
+            call = self.queue.get()
+            try:
+                if call is None:
+                    return
+                self.make_call(*call)
+            finally:
+                self.queue.task_done()
+
+    def make_call(self, method, args, kwargs):
+        tabname = args[0] if method in ("update_tab", "append_tab") else None
+        if method == "append_tab" and tabname in self.failed_tabs:
+            logger.warning(f"Not appending to {tabname} in {self.name} as it failed")
+            return
+        try:
+            self.call_with_retries(method, args, kwargs)
+        except Exception:
+            if tabname:
+                self.failed_tabs.add(tabname)
+            logger.exception(f"Output {self.name} failed in {method}!")
+            if self.errors_on_exit:
+                self.errors_on_exit.add(
+                    f"Output {self.name} failed in {method}! Error: {format_exc()}"
+                )
+            return
+        if method == "update_tab":
+            self.failed_tabs.discard(tabname)
+
+    def call_with_retries(self, method, args, kwargs):
+        if method not in self.retry_methods:
+            return self.call(method, args, kwargs)
+        for attempt in range(self.max_retries):
+            try:
+                return self.call(method, args, kwargs)
+            except OSError as e:
+                # Connection errors and timeouts are usually transient
+                if attempt == self.max_retries - 1:
+                    raise
+                wait = self.retry_wait * 2**attempt
+                logger.warning(f"Output {self.name} {method} error {e}, retrying")
+                sleep(wait)
+
+    def call(self, method, args, kwargs):
+        function = getattr(self.output, method)
+        if not self.metrics:
+            return function(*args, **kwargs)
+        with self.metrics.measure("outputs", f"{self.name}.{method}") as record:
+            if len(args) > 1 and isinstance(args[1], (list, tuple)):
+                record["rows_out"] = len(args[1])
+            return function(*args, **kwargs)
+
+    def put(self, method, *args, **kwargs):
+        self.queue.put((method, args, kwargs))
+
+    def update_tab(self, *args, **kwargs):
+        self.put("update_tab", *args, **kwargs)
+
+    def append_tab(self, *args, **kwargs):
+        self.put("append_tab", *args, **kwargs)
+
+    def save(self, **kwargs):
+        self.put("save", **kwargs)
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+
+
+class OutputDispatcher(dict):
+    """Mapping from output name to a SinkWorker for the output so that each output
+    is updated on its own thread and a slow one does not hold up the others or the
+    scrapers. close must be called to wait for all queued calls to be made.
+
+    Args:
+        outputs (Dict[str, BaseOutput]): Mapping from output name to output
+        queue_size (int): Maximum number of queued calls per output. Defaults to 16.
+        errors_on_exit (Optional[ErrorsOnExit]): ErrorsOnExit object. Defaults to None.
+        metrics (Optional[RunMetrics]): Metrics in which to record timings. Defaults to None.
+        max_retries (int): Maximum number of attempts for each call. Defaults to 3.
+        retry_wait (float): Seconds to wait before the first retry. Defaults to 1.
+    """
+
+    def __init__(
+        self,
+        outputs,
+        queue_size=16,
+        errors_on_exit=None,
+        metrics=None,
+        max_retries=3,
+        retry_wait=1,
+    ):
+        super().__init__(
+            (
+                name,
+                SinkWorker(
+                    name,
+                    output,
+                    queue_size,
+                    errors_on_exit,
+                    metrics,
+                    max_retries,
+                    retry_wait,
+                ),
+            )
+            for name, output in outputs.items()
+        )
+
+    def close(self):
+        for worker in self.values():
+            worker.close()
@@ -0,0 +1,66 @@
+from threading import Lock
+
+from hdx.scraper.outputs.excelfile import ExcelFile as HDXExcelFile
+from openpyxl import Workbook
+
+
+class ExcelFile(HDXExcelFile):
+    """ExcelFile whose workbook is write only so that rows are streamed to disk as
+    they are added rather than held in memory. A tab that is updated again is
+    replaced.
+
+    Args:
+        excel_path (str): Path to output spreadsheet
+        tabs (Dict[str, str]): Dictionary of mappings from internal name to spreadsheet tab name
+        updatetabs (List[str]): Tabs to update
+    """
+
+    def __init__(self, excel_path, tabs, updatetabs):
+        super().__init__(excel_path, tabs, updatetabs)
+        self.workbook = Workbook(write_only=True)
+        # Scrapers can run concurrently and openpyxl workbooks are not thread safe
+        self.lock = Lock()
+
+    def update_tab(self, tabname, values, hxltags=None):
+        if tabname not in self.updatetabs:
+            return
+        if not isinstance(values, list):
+            from openpyxl.utils.dataframe import dataframe_to_rows
+
+            headers = list(values.columns.values)
+            rows = [headers]
+            if hxltags:
+                rows.append([hxltags.get(header, "") for header in headers])
+            rows.extend(dataframe_to_rows(values, index=False, header=False))
+            values = rows
+        sheetname = self.tabs[tabname]
+        with self.lock:
+            if sheetname in self.workbook.sheetnames:
+                tab = self.workbook[sheetname]
+                tab.close()
+                self.workbook.remove(tab)
+            tab = self.workbook.create_sheet(sheetname)
+            for row in values:
+                tab.append(row)
+
+    def append_tab(self, tabname, values):
+        if tabname not in self.updatetabs:
+            return
+        with self.lock:
+            tab = self.workbook[self.tabs[tabname]]
+            for row in values[2:]:
+                tab.append(row)
+
+    def save(self):
+        # A workbook needs at least one sheet
+        if not self.workbook.sheetnames:
+            self.workbook.create_sheet()
+        # Order sheets by tab rather than by when they were created
+        order = {self.tabs[tab]: i for i, tab in enumerate(self.updatetabs)}
+        sheetnames = sorted(
+            self.workbook.sheetnames, key=lambda name: order.get(name, -1)
+        )
+        for i, sheetname in enumerate(sheetnames):
+            offset = i - self.workbook.sheetnames.index(sheetname)
+            self.workbook.move_sheet(sheetname, offset=offset)
+        super().save()
@@ -0,0 +1,229 @@
+import logging
+from random import random
+from time import sleep
+
+from gspread.exceptions import APIError, WorksheetNotFound
+from hdx.scraper.outputs.googlesheets import GoogleSheets as HDXGoogleSheets
+
+logger = logging.getLogger(__name__)
+
+
+def normalise(value):
+    if value is None:
+        return ""
+    return value
+
+
+def get_range(title, row_number=None):
+    """Get a range in A1 notation for a tab or a row of it, doubling any quotes in
+    the title"""
+    title = title.replace("'", "''")
+    if row_number is None:
+        return f"'{title}'"
+    return f"'{title}'!A{row_number}"
+
+
+def get_changed_rows(published, values):
+    """Compare published rows with new ones returning a list of (row number, rows)
+    for each block of consecutive rows that differ. Cells that are no longer needed
+    are blanked."""
+    width = max((len(row) for row in published + values), default=0)
+    changed = list()
+    block = None
+    for i in range(max(len(published), len(values))):
+        rows = list()
+        for table in (published, values):
+            if i < len(table):
+                row = [normalise(x) for x in table[i]]
+            else:
+                row = list()
+            rows.append(row + [""] * (width - len(row)))
+        old_row, new_row = rows
+        if new_row == old_row:
+            block = None
+            continue
+        if block is None:
+            block = list()
+            changed.append((i + 1, block))
+        block.append(new_row)
+    return changed
+
+
+class GoogleSheets(HDXGoogleSheets):
+    """GoogleSheets that can also append rows and adds any tabs that are missing
+    from the spreadsheets. In diff mode, it defers writing until save. It then
+    compares tabs with what is already published and sends only the rows that
+    changed, in batched requests per spreadsheet. Every request backs off when the
+    API rate limits or has a server error. Tabs that are written in chunks with
+    append_tab are not diffed, since that would hold them in memory until save, so
+    they are replaced and appended to as in normal mode.
+
+    Args:
+        configuration (Dict): Configuration for Google Sheets
+        gsheet_auth (str): Authorisation for Google Sheets/Drive
+        updatesheets (List[str]): List of spreadsheets to update (eg. prod, test)
+        tabs (Dict[str, str]): Dictionary of mappings from internal name to spreadsheet tab name
+        updatetabs (List[str]): Tabs to update
+        diff (bool): Whether to only send changes on save. Defaults to False.
+        max_cells (int): Maximum number of cells in each batched request. Defaults to 50000.
+        max_retries (int): Maximum number of attempts for each request. Defaults to 5.
+    """
+
+    def __init__(
+        self,
+        configuration,
+        gsheet_auth,
+        updatesheets,
+        tabs,
+        updatetabs,
+        diff=False,
+        max_cells=50000,
+        max_retries=5,
+    ):
+        super().__init__(configuration, gsheet_auth, updatesheets, tabs, updatetabs)
+        self.diff = diff
+        self.max_cells = max_cells
+        self.max_retries = max_retries
+        self.worksheets = dict()
+        self.pending = dict()
+
+    def add_worksheet(self, spreadsheet, title, no_rows=1000, no_cols=26):
+        logger.info(f"Adding missing tab {title} to {spreadsheet.title}")
+        return self.call_with_backoff(
+            spreadsheet.add_worksheet, title, no_rows, no_cols
+        )
+
+    def open_spreadsheet(self, sheet):
+        return self.call_with_backoff(self.gc.open_by_url, self.configuration[sheet])
+
+    def get_worksheet(self, sheet, tabname):
+        key = (sheet, tabname)
+        worksheet = self.worksheets.get(key)
+        if worksheet is None:
+            spreadsheet = self.open_spreadsheet(sheet)
+            title = self.tabs[tabname]
+            try:
+                worksheet = self.call_with_backoff(spreadsheet.worksheet, title)
+            except WorksheetNotFound:
+                worksheet = self.add_worksheet(spreadsheet, title)
+            self.worksheets[key] = worksheet
+        return worksheet
+
+    def get_worksheets(self, tabname):
+        # Tabs added to the configuration are created in existing spreadsheets
+        return [
+            self.get_worksheet(sheet, tabname)
+            for sheet in self.configuration
+            if sheet in self.updatesheets
+        ]
+
+    def write_tab(self, tabname, values):
+        for worksheet in self.get_worksheets(tabname):
+            self.call_with_backoff(worksheet.clear)
+            self.call_with_backoff(worksheet.update, range_name="A1", values=values)
+
+    def update_tab(self, tabname, values, hxltags=None, limit=None):
+        if tabname not in self.updatetabs:
+            return
+        if self.diff:
+            self.pending[tabname] = [list(row) for row in values]
+            return
+        if not isinstance(values, list):
+            self.get_worksheets(tabname)
+            return self.call_with_backoff(
+                super().update_tab, tabname, values, hxltags, limit
+            )
+        self.write_tab(tabname, values)
+
+    def append_tab(self, tabname, values):
+        if tabname not in self.updatetabs:
+            return
+        # A tab written in chunks is written out straight away rather than diffed
+        pending = self.pending.pop(tabname, None)
+        if pending is not None:
+            self.write_tab(tabname, pending)
+        for worksheet in self.get_worksheets(tabname):
+            self.call_with_backoff(
+                worksheet.append_rows, values[2:], value_input_option="RAW"
+            )
+
+    def call_with_backoff(self, function, *args, **kwargs):
+        for attempt in range(self.max_retries):
+            try:
+                return function(*args, **kwargs)
+            except APIError as e:
+                if e.code not in (429, 500, 502, 503):
+                    raise
+                if attempt == self.max_retries - 1:
+                    raise
+                wait = 2**attempt + random()
+                logger.warning(f"Sheets API error {e.code}, retrying in {wait:.1f}s")
+                sleep(wait)
+
+    def get_batches(self, changes):
+        """Split changes into lists of ranges holding at most max_cells cells"""
+        batches = list()
+        batch = list()
+        cells = 0
+        for title, row_number, rows in changes:
+            width = max(len(rows[0]), 1)
+            no_rows = max(self.max_cells // width, 1)
+            for i in range(0, len(rows), no_rows):
+                block = rows[i : i + no_rows]
+                if batch and cells + len(block) * width > self.max_cells:
+                    batches.append(batch)
+                    batch = list()
+                    cells = 0
+                batch.append(
+                    {"range": get_range(title, row_number + i), "values": block}
+                )
+                cells += len(block) * width
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def update_spreadsheet(self, spreadsheet):
+        worksheets = {
+            x.title: x for x in self.call_with_backoff(spreadsheet.worksheets)
+        }
+        titles = [self.tabs[tabname] for tabname in self.pending]
+        for title in titles:
+            if title not in worksheets:
+                worksheets[title] = self.add_worksheet(spreadsheet, title)
+        response = self.call_with_backoff(
+            spreadsheet.values_batch_get,
+            [get_range(title) for title in titles],
+            params={"valueRenderOption": "UNFORMATTED_VALUE"},
+        )
+        changes = list()
+        for title, values, valuerange in zip(
+            titles, self.pending.values(), response["valueRanges"]
+        ):
+            worksheet = worksheets[title]
+            no_rows = max(len(values), worksheet.row_count)
+            no_cols = max((len(row) for row in values), default=0)
+            no_cols = max(no_cols, worksheet.col_count)
+            if no_rows > worksheet.row_count or no_cols > worksheet.col_count:
+                self.call_with_backoff(worksheet.resize, no_rows, no_cols)
+            published = valuerange.get("values", [])
+            for row_number, rows in get_changed_rows(published, values):
+                changes.append((title, row_number, rows))
+        batches = self.get_batches(changes)
+        no_rows = sum(len(x[2]) for x in changes)
+        logger.info(
+            f"Updating {no_rows} changed rows in {spreadsheet.title} using "
+            f"{len(batches)} requests"
+        )
+        for batch in batches:
+            self.call_with_backoff(
+                spreadsheet.values_batch_update,
+                {"valueInputOption": "RAW", "data": batch},
+            )
+
+    def save(self, **kwargs):
+        if not self.diff or not self.pending:
+            return
+        for sheet in self.configuration:
+            if sheet not in self.updatesheets:
+                continue
+            self.update_spreadsheet(self.open_spreadsheet(sheet))
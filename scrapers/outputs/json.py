@@ -0,0 +1,230 @@
+import gzip
+import json
+import logging
+from os.path import join, splitext
+from shutil import copyfileobj
+from tempfile import TemporaryFile
+
+from hdx.scraper.outputs.json import JsonFile as HDXJsonFile
+from hdx.utilities.loader import load_json
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+
+class SpooledRows:
+    """List of rows as dictionaries that is kept in a temporary file rather than in
+    memory. Rows can be appended and iterated over."""
+
+    def __init__(self, rows=()):
+        self.file = TemporaryFile("w+", encoding="utf-8")
+        self.no_rows = 0
+        for row in rows:
+            self.append(row)
+
+    def append(self, row):
+        self.file.write(json.dumps(row))
+        self.file.write("\n")
+        self.no_rows += 1
+
+    def __len__(self):
+        return self.no_rows
+
+    def __iter__(self):
+        self.file.seek(0)
+        try:
+            for line in self.file:
+                yield json.loads(line)
+        finally:
+            self.file.seek(0, 2)
+
+
+def get_hxltags(rows):
+    hxltags = list()
+    for row in rows:
+        for hxltag in row:
+            if hxltag not in hxltags:
+                hxltags.append(hxltag)
+    return hxltags
+
+
+def to_columns(rows):
+    """Convert a list of dictionaries into a dictionary with a shared list of HXL
+    hashtags and a list of values for each of them"""
+    hxltags = get_hxltags(rows)
+    values = [[row.get(hxltag) for row in rows] for hxltag in hxltags]
+    return {"hxltags": hxltags, "values": values}
+
+
+def write_json(data, f, compact):
+    """Write data to f as json.dump would with the separators and escaping that the
+    HDX library uses or, if compact, the most compact ones. Spooled rows are
+    streamed from disk and converted to columns if compact."""
+    if compact:
+        kwargs = {"separators": (",", ":"), "ensure_ascii": False}
+    else:
+        kwargs = {"separators": (", ", ": ")}
+    item_separator, key_separator = kwargs["separators"]
+
+    def write_list(values):
+        f.write("[")
+        for i, value in enumerate(values):
+            if i:
+                f.write(item_separator)
+            f.write(json.dumps(value, **kwargs))
+        f.write("]")
+
+    f.write("{")
+    for i, (key, value) in enumerate(data.items()):
+        if i:
+            f.write(item_separator)
+        f.write(json.dumps(key, **kwargs))
+        f.write(key_separator)
+        if not isinstance(value, SpooledRows):
+            f.write(json.dumps(value, **kwargs))
+        elif not compact:
+            write_list(value)
+        else:
+            # Each column is streamed in its own pass over the rows
+            hxltags = get_hxltags(value)
+            f.write('{"hxltags":')
+            f.write(json.dumps(hxltags, **kwargs))
+            f.write(',"values":[')
+            for j, hxltag in enumerate(hxltags):
+                if j:
+                    f.write(",")
+                write_list(row.get(hxltag) for row in value)
+            f.write("]}")
+    f.write("}")
+
+
+def is_columns(value):
+    return isinstance(value, dict) and value.keys() == {"hxltags", "values"}
+
+
+def from_columns(columns):
+    hxltags = columns["hxltags"]
+    rows = list()
+    for values in zip(*columns["values"]):
+        rows.append(
+            {hxltag: x for hxltag, x in zip(hxltags, values) if x is not None}
+        )
+    return rows
+
+
+def load_json_output(path):
+    """Load JSON output in either format returning it with rows as dictionaries"""
+    data = load_json(path)
+    for key, value in data.items():
+        if is_columns(value):
+            data[key] = from_columns(value)
+    return data
+
+
+def compress(path, compressions):
+    paths = list()
+    for compression in compressions:
+        if compression == "gzip":
+            compressed_path = f"{path}.gz"
+            with open(path, "rb") as f, open(compressed_path, "wb") as out:
+                with gzip.GzipFile(filename="", fileobj=out, mode="wb", mtime=0) as gz:
+                    copyfileobj(f, gz)
+        elif compression == "brotli":
+            if brotli is None:
+                logger.warning("brotli is not installed so not using it!")
+                continue
+            compressed_path = f"{path}.br"
+            compressor = brotli.Compressor()
+            with open(path, "rb") as f, open(compressed_path, "wb") as out:
+                for chunk in iter(lambda: f.read(1048576), b""):
+                    out.write(compressor.process(chunk))
+                out.write(compressor.finish())
+        else:
+            raise ValueError(f"Unknown compression {compression}!")
+        paths.append(compressed_path)
+    return paths
+
+
+class JsonFile(HDXJsonFile):
+    """JsonFile that can alternatively save in a compact format where each tab is
+    held as columns sharing one list of HXL hashtags. In compact mode, the output can
+    also be split into a file per tab and compressed as set in the configuration.
+    Rows appended to a tab are spooled to a temporary file rather than held in
+    memory and are streamed into the output on save.
+
+    Args:
+        configuration (Dict): Configuration for JSON output
+        updatetabs (List[str]): Tabs to update
+        compact (bool): Whether to save in compact format. Defaults to False.
+    """
+
+    # update_tab adds rows from lists to any already under the key so retrying it
+    # could duplicate them
+    retry_methods = ("save",)
+
+    def __init__(self, configuration, updatetabs, compact=False):
+        super().__init__(configuration, updatetabs)
+        self.compact = compact
+
+    def append_tab(self, tabname, values):
+        if tabname not in self.updatetabs:
+            return
+        key = f"{tabname}{self.suffix}"
+        rows = self.json.get(key, [])
+        if not isinstance(rows, SpooledRows):
+            self.json[key] = SpooledRows(rows)
+        # Rows from lists are always added to any already under the key
+        self.update_tab(tabname, values)
+
+    def write(self, data, filepath, compact=True):
+        logger.info(f"Writing JSON to {filepath}")
+        with open(filepath, "w", encoding="utf-8") as f:
+            write_json(data, f, compact)
+        return filepath
+
+    def save_compact(self, folder=None):
+        compact = self.configuration["compact"]
+        filepath = self.configuration["output"]
+        if folder:
+            filepath = join(folder, filepath)
+        data = dict()
+        for key, value in self.json.items():
+            if isinstance(value, list) and all(isinstance(x, dict) for x in value):
+                value = to_columns(value)
+            data[key] = value
+        filepaths = [self.write(data, filepath)]
+        if compact.get("split"):
+            # The viz can load each tab only when it is needed
+            root, extension = splitext(filepath)
+            for key, value in data.items():
+                tab = key.replace(self.suffix, "")
+                filepaths.append(self.write({key: value}, f"{root}_{tab}{extension}"))
+        for filepath in list(filepaths):
+            filepaths.extend(compress(filepath, compact.get("compress", [])))
+        return filepaths
+
+    def save(self, folder=None, **kwargs):
+        # Scrapers can run concurrently so order keys by tab rather than by when
+        # they were added
+        order = {f"{tab}{self.suffix}": i for i, tab in enumerate(self.updatetabs)}
+        keys = sorted(self.json, key=lambda key: order.get(key, len(order)))
+        self.json = {key: self.json[key] for key in keys}
+        if self.compact:
+            if self.configuration.get("additional_outputs"):
+                logger.warning("Additional outputs are not written in compact format!")
+            return self.save_compact(folder)
+        if self.configuration.get("additional_outputs"):
+            # Additional outputs are filtered from rows in memory
+            self.json = {
+                key: list(value) if isinstance(value, SpooledRows) else value
+                for key, value in self.json.items()
+            }
+            return super().save(folder, **kwargs)
+        filepath = self.configuration["output"]
+        if folder:
+            filepath = join(folder, filepath)
+        return [self.write(self.json, filepath, compact=False)]
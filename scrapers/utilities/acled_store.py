@@ -0,0 +1,180 @@
+import json
+import logging
+from os import makedirs, remove
+from os.path import dirname, exists
+
+from hdx.utilities.dateparse import parse_date
+
+logger = logging.getLogger(__name__)
+
+
+class ACLEDStore:
+    """Local store of ACLED events that have already been ingested and had their
+    pcodes resolved, keyed by ACLED event id. The store is an append only log of
+    JSON lines which is replayed on load and compacted when it has grown to more
+    than compact_ratio times the number of live events. Events are held in groups of
+    (country, year) matching the files downloaded from ACLED, and the latest event
+    date for each country is kept as a watermark along with the date from which
+    events have been ingested. Event rows start with the event date so that a group
+    can be replaced from a date on.
+
+    Args:
+        path (str): Path to store file
+        rebuild (bool): Whether to discard the store and rebuild it. Defaults to False.
+        compact_ratio (int): Log lines per live event that triggers compaction. Defaults to 2.
+    """
+
+    def __init__(self, path, rebuild=False, compact_ratio=2):
+        self.path = path
+        self.compact_ratio = compact_ratio
+        self.events = dict()
+        self.groups = dict()
+        self.watermarks = dict()
+        self.start_dates = dict()
+        self.pending = list()
+        self.no_lines = 0
+        if rebuild:
+            logger.info(f"Rebuilding ACLED store {path}")
+            if exists(path):
+                remove(path)
+        else:
+            self.load()
+
+    def load(self):
+        if not exists(self.path):
+            return
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                self.replay(json.loads(line))
+                self.no_lines += 1
+        logger.info(f"Loaded {len(self.events)} ACLED events from {self.path}")
+
+    def replay(self, entry):
+        event_id = entry.get("e")
+        if event_id:
+            event = self.events.pop(event_id, None)
+            if event:
+                del self.groups[event[0], event[1]][event_id]
+            self.events[event_id] = (entry["c"], entry["y"], entry["r"])
+            self.groups.setdefault((entry["c"], entry["y"]), dict())[event_id] = None
+            return
+        group = entry.get("d")
+        if group:
+            self.drop_group(*group, entry.get("f"))
+            return
+        if "s" in entry:
+            self.start_dates.update(entry["s"])
+            return
+        self.watermarks.update(entry["w"])
+
+    def drop_group(self, countryiso3, year, from_date=None):
+        group = self.groups.get((countryiso3, year), dict())
+        for event_id in list(group):
+            if from_date is None or self.events[event_id][2][0] >= from_date:
+                del self.events[event_id]
+                del group[event_id]
+
+    def add(self, entry):
+        self.replay(entry)
+        self.pending.append(entry)
+
+    def get_watermark(self, countryiso3):
+        watermark = self.watermarks.get(countryiso3)
+        if watermark is None:
+            return None
+        return parse_date(watermark)
+
+    def get_start_date(self, countryiso3):
+        """Get the date from which events have been ingested for a country or None if
+        there are none. Stores from before this was kept fall back on the start of
+        the earliest year with events."""
+        start_date = self.start_dates.get(countryiso3)
+        if start_date:
+            return parse_date(start_date)
+        years = [
+            year
+            for (iso3, year), group in self.groups.items()
+            if iso3 == countryiso3 and group
+        ]
+        if not years or countryiso3 not in self.watermarks:
+            return None
+        return parse_date(f"{min(years)}-01-01")
+
+    def get_latest_date(self, countryiso3s):
+        watermarks = [self.watermarks.get(x) for x in countryiso3s]
+        watermarks = [x for x in watermarks if x]
+        if not watermarks:
+            return None
+        return parse_date(max(watermarks))
+
+    def replace_group(self, countryiso3, year, events, from_date=None):
+        """Replace all events for a country and year, or only those from from_date
+        on if given, with those given which is an iterable of (event id, row)"""
+        entry = {"d": [countryiso3, year]}
+        if from_date:
+            entry["f"] = from_date.isoformat()
+        self.add(entry)
+        for event_id, row in events:
+            self.add({"e": event_id, "c": countryiso3, "y": year, "r": row})
+
+    def update_watermark(self, countryiso3, latest_date):
+        """Raise the watermark for a country to latest_date if it is later"""
+        if latest_date is None:
+            return
+        latest_date = latest_date.date().isoformat()
+        if latest_date > self.watermarks.get(countryiso3, ""):
+            self.add({"w": {countryiso3: latest_date}})
+
+    def update_start_date(self, countryiso3, start_date):
+        """Lower the date from which events have been ingested for a country to
+        start_date if it is earlier"""
+        start_date = start_date.date().isoformat()
+        if start_date < self.start_dates.get(countryiso3, "9999"):
+            self.add({"s": {countryiso3: start_date}})
+
+    def get_rows(self, countryiso3s, start_date=None):
+        """Get (country, event row) for events on or after start_date ordered by
+        year then country in the order given then latest event date first as ACLED
+        returns them. Only one group of events is sorted at a time."""
+        start = start_date.date().isoformat() if start_date else ""
+        countries = {countryiso3: i for i, countryiso3 in enumerate(countryiso3s)}
+        groups = [x for x in self.groups if x[0] in countries]
+        groups.sort(key=lambda x: (x[1], countries[x[0]]))
+        for countryiso3, year in groups:
+            rows = [self.events[x][2] for x in self.groups[countryiso3, year]]
+            rows = [row for row in rows if row[0] >= start]
+            rows.sort(key=lambda row: row[0], reverse=True)
+            for row in rows:
+                yield countryiso3, row
+
+    def write(self, entries, mode):
+        folder = dirname(self.path)
+        if folder:
+            makedirs(folder, exist_ok=True)
+        with open(self.path, mode, encoding="utf-8") as f:
+            for entry in entries:
+                f.write(json.dumps(entry))
+                f.write("\n")
+
+    def compact(self):
+        entries = [
+            {"e": event_id, "c": iso3, "y": year, "r": row}
+            for event_id, (iso3, year, row) in self.events.items()
+        ]
+        if self.watermarks:
+            entries.append({"w": self.watermarks})
+        if self.start_dates:
+            entries.append({"s": self.start_dates})
+        logger.info(f"Compacting ACLED store {self.path}")
+        self.write(entries, "w")
+        self.no_lines = len(entries)
+        self.pending = list()
+
+    def save(self):
+        no_lines = self.no_lines + len(self.pending)
+        if no_lines > self.compact_ratio * (len(self.events) + 1):
+            self.compact()
+            return
+        self.write(self.pending, "a")
+        self.no_lines = no_lines
+        self.pending = list()
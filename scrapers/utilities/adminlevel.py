@@ -0,0 +1,110 @@
+import hashlib
+import json
+import logging
+from os import makedirs
+from os.path import dirname, exists
+from threading import Lock
+
+from hdx.location.adminlevel import AdminLevel
+
+logger = logging.getLogger(__name__)
+
+
+class CachedAdminLevel(AdminLevel):
+    """AdminLevel that memoises name to pcode lookups by country, name and whether
+    fuzzy matching is allowed. The cache can be persisted to a JSON file between
+    runs, in which case it is discarded if the admin configuration or admin level
+    overrides or gazetteer have changed. Lookups that pass a logname are not cached
+    because AdminLevel records their matches and errors for output at the end of the
+    run. If a gazetteer is given, admin units are set up from it.
+
+    Args:
+        admin_config (Optional[Dict]): Configuration dictionary. Defaults to None.
+        admin_level (int): Admin level. Defaults to 1.
+        admin_level_overrides (Optional[Dict]): Countries at other admin levels. Defaults to None.
+        cache_path (Optional[str]): Path to persisted cache. Defaults to None.
+        gazetteer (Optional[Gazetteer]): Gazetteer of admin units. Defaults to None.
+    """
+
+    def __init__(
+        self,
+        admin_config=None,
+        admin_level=1,
+        admin_level_overrides=None,
+        cache_path=None,
+        gazetteer=None,
+    ):
+        admin_config = admin_config or dict()
+        admin_level_overrides = admin_level_overrides or dict()
+        super().__init__(admin_config, admin_level, admin_level_overrides)
+        self.fingerprint = self.get_fingerprint(
+            admin_config,
+            admin_level,
+            admin_level_overrides,
+            gazetteer.hash if gazetteer else None,
+        )
+        if gazetteer:
+            gazetteer.setup(self)
+        self.cache_path = cache_path
+        self.cache = dict()
+        # Scrapers look up pcodes from several threads
+        self.lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.load_cache()
+
+    @staticmethod
+    def get_fingerprint(
+        admin_config, admin_level, admin_level_overrides, gazetteer_hash=None
+    ):
+        configuration = {
+            "admin_config": admin_config,
+            "admin_level": admin_level,
+            "admin_level_overrides": admin_level_overrides,
+            "gazetteer": gazetteer_hash,
+        }
+        configuration = json.dumps(configuration, sort_keys=True, default=str)
+        return hashlib.sha256(configuration.encode("utf-8")).hexdigest()
+
+    def load_cache(self):
+        if not self.cache_path or not exists(self.cache_path):
+            return
+        with open(self.cache_path, encoding="utf-8") as f:
+            cache = json.load(f)
+        if cache["fingerprint"] != self.fingerprint:
+            logger.info(f"Admin configuration changed so ignoring {self.cache_path}")
+            return
+        for countryiso3, name, fuzzy_match, pcode, exact in cache["pcodes"]:
+            self.cache[(countryiso3, name, fuzzy_match)] = (pcode, exact)
+
+    def save_cache(self):
+        if not self.cache_path:
+            return
+        pcodes = [
+            [countryiso3, name, fuzzy_match, pcode, exact]
+            for (countryiso3, name, fuzzy_match), (pcode, exact) in self.cache.items()
+        ]
+        folder = dirname(self.cache_path)
+        if folder:
+            makedirs(folder, exist_ok=True)
+        with open(self.cache_path, "w", encoding="utf-8") as f:
+            json.dump({"fingerprint": self.fingerprint, "pcodes": pcodes}, f)
+
+    def get_pcode(self, countryiso3, name, fuzzy_match=True, logname=None):
+        if logname:
+            return super().get_pcode(countryiso3, name, fuzzy_match, logname)
+        key = (countryiso3, name, fuzzy_match)
+        with self.lock:
+            result = self.cache.get(key)
+            if result is not None:
+                self.hits += 1
+                return result
+            self.misses += 1
+        result = super().get_pcode(countryiso3, name, fuzzy_match)
+        self.cache[key] = result
+        return result
+
+    def output_cache_stats(self):
+        line = f"Pcode cache: {self.hits} hits, {self.misses} misses"
+        logger.info(line)
+        return line
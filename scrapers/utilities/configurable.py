@@ -0,0 +1,91 @@
+from hdx.scraper.configurable import rowparser
+from hdx.scraper.configurable.scraper import ConfigurableScraper
+from hdx.scraper.runner import Runner
+
+from .expressions import compile_expression
+
+
+class CompiledTransform(str):
+    """Transform of an input column. ConfigurableScraper evaluates a transform with
+    eval(transform.replace(column, "val")) for every value, which here gives code
+    compiled up front rather than a string to be parsed again each time.
+
+    Args:
+        transform (str): Transform expression
+        col (str): Input column
+    """
+
+    def __new__(cls, transform, col):
+        compiled = super().__new__(cls, transform)
+        compiled.col = col
+        compiled.code = compile(transform.replace(col, "val"), "<transform>", "eval")
+        return compiled
+
+    def replace(self, old, new, count=-1):
+        if old == self.col and new == "val":
+            return self.code
+        return super().replace(old, new, count)
+
+
+class CompiledRowParser(rowparser.RowParser):
+    """RowParser that evaluates its prefilter with a compiled expression. It takes
+    over a RowParser that has already been set up.
+
+    Args:
+        parser (RowParser): RowParser to take over
+    """
+
+    def __init__(self, parser):
+        vars(self).update(vars(parser))
+        self.prefilter_function = None
+        if self.prefilter:
+            self.prefilter_function = compile_expression(
+                self.prefilter, "row", rowparser
+            )
+            self.prefilter = None
+
+    def flatten(self, row):
+        # Applying the prefilter here rather than to all rows at the end makes no
+        # difference to which are kept or their order
+        for newrow in super().flatten(row):
+            if self.prefilter_function is None or self.prefilter_function(newrow):
+                yield newrow
+
+
+class CompiledConfigurableScraper(ConfigurableScraper):
+    """ConfigurableScraper that evaluates its prefilter and transforms with compiled
+    expressions rather than evaluating their strings for every row. It takes over a
+    ConfigurableScraper that has already been set up and otherwise runs as one.
+
+    Args:
+        scraper (ConfigurableScraper): ConfigurableScraper to take over
+    """
+
+    def __init__(self, scraper):
+        vars(self).update(vars(scraper))
+        # Subsets can be those of the dataset information, which is left as it is
+        self.subsets = [
+            dict(
+                subset,
+                transform={
+                    col: CompiledTransform(transform, col)
+                    for col, transform in subset.get("transform", {}).items()
+                },
+            )
+            for subset in self.subsets
+        ]
+
+    def run_scraper(self, iterator):
+        # ConfigurableScraper.run sets up a RowParser just before calling this
+        self.rowparser = CompiledRowParser(self.rowparser)
+        super().run_scraper(iterator)
+
+
+class CompiledRunner(Runner):
+    """Runner whose configurable scrapers are CompiledConfigurableScrapers"""
+
+    def add_configurable(self, *args, **kwargs):
+        scraper_name = super().add_configurable(*args, **kwargs)
+        scraper = self.scrapers[scraper_name]
+        self.scrapers[scraper_name] = CompiledConfigurableScraper(scraper)
+        return scraper_name
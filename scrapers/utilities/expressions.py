@@ -0,0 +1,105 @@
+import ast
+import builtins
+import operator
+from functools import lru_cache
+
+comparisons = {
+    ast.Eq: operator.eq,
+    ast.NotEq: operator.ne,
+    ast.Lt: operator.lt,
+    ast.LtE: operator.le,
+    ast.Gt: operator.gt,
+    ast.GtE: operator.ge,
+    ast.Is: operator.is_,
+    ast.IsNot: operator.is_not,
+    ast.In: lambda x, y: x in y,
+    ast.NotIn: lambda x, y: x not in y,
+}
+
+
+def get_operand(node, variable):
+    """Get a function returning the value of node given the value of variable if node
+    is variable or a constant item of it, otherwise None"""
+    if isinstance(node, ast.Name) and node.id == variable:
+        return lambda x: x
+    if (
+        isinstance(node, ast.Subscript)
+        and isinstance(node.value, ast.Name)
+        and node.value.id == variable
+        and isinstance(node.slice, ast.Constant)
+    ):
+        return operator.itemgetter(node.slice.value)
+    return None
+
+
+def get_constant(node):
+    try:
+        return True, ast.literal_eval(node)
+    except (ValueError, TypeError, SyntaxError):
+        return False, None
+
+
+def get_function(node, namespace):
+    if not isinstance(node, ast.Name):
+        return None
+    function = namespace.get(node.id, getattr(builtins, node.id, None))
+    if not callable(function):
+        return None
+    return function
+
+
+def get_fast_path(node, variable, namespace):
+    """Get a plain Python function for comparisons of the variable (or an item of it)
+    with a constant, calls of a function on it and and/or combinations of these, or
+    None if node is not one of these forms"""
+    if isinstance(node, ast.Compare) and len(node.ops) == 1:
+        getter = get_operand(node.left, variable)
+        is_constant, constant = get_constant(node.comparators[0])
+        compare = comparisons.get(type(node.ops[0]))
+        if getter and is_constant and compare:
+            return lambda x: compare(getter(x), constant)
+        getter = get_operand(node.comparators[0], variable)
+        is_constant, constant = get_constant(node.left)
+        if getter and is_constant and compare:
+            return lambda x: compare(constant, getter(x))
+        return None
+    if isinstance(node, ast.Call):
+        if len(node.args) != 1 or node.keywords:
+            return None
+        function = get_function(node.func, namespace)
+        getter = get_operand(node.args[0], variable)
+        if function and getter:
+            return lambda x: function(getter(x))
+        return None
+    if isinstance(node, ast.BoolOp):
+        parts = [get_fast_path(x, variable, namespace) for x in node.values]
+        if not all(parts):
+            return None
+        is_and = isinstance(node.op, ast.And)
+
+        def boolop(x):
+            # Returns the deciding value as and/or do
+            for part in parts:
+                value = part(x)
+                if is_and != bool(value):
+                    return value
+            return value
+
+        return boolop
+    return None
+
+
+@lru_cache(maxsize=None)
+def compile_expression(expression, variable, module):
+    """Compile an expression on variable (eg. row or val) evaluated with the globals of
+    module into a function of the value of variable. Common comparison, membership
+    and function call forms become plain Python functions while anything else is
+    compiled once rather than on every evaluation."""
+    namespace = vars(module)
+    fast_path = get_fast_path(
+        ast.parse(expression, mode="eval").body, variable, namespace
+    )
+    if fast_path:
+        return fast_path
+    code = compile(expression, "<expression>", "eval")
+    return lambda x: eval(code, namespace, {variable: x})
@@ -0,0 +1,19 @@
+from os.path import exists, join
+
+from hdx.scraper.utilities.fallbacks import Fallbacks
+from hdx.utilities.path import temp_dir
+from hdx.utilities.saver import save_json
+
+from ..outputs.json import load_json_output
+
+
+def add_fallbacks(fallbacks_path, **kwargs):
+    """Add fallbacks from JSON output that can be in compact format, which Fallbacks
+    cannot read, so it is converted back to rows first"""
+    if not exists(fallbacks_path):
+        return Fallbacks.add(fallbacks_path, **kwargs)
+    data = load_json_output(fallbacks_path)
+    with temp_dir("HornAfricaFallbacks") as folder:
+        path = join(folder, "fallbacks.json")
+        save_json(data, path)
+        Fallbacks.add(path, **kwargs)
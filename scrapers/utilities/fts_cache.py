@@ -0,0 +1,112 @@
+import json
+import logging
+from os import makedirs, replace
+from os.path import dirname, exists
+from threading import Lock
+from time import time
+
+from hdx.utilities.loader import load_json
+
+from .snapshots import get_hash
+
+logger = logging.getLogger(__name__)
+
+
+class FTSCache:
+    """Persistent cache of FTS responses. Responses for a plan are kept along with a
+    hash of the plan's last update, requirements and funding in the progress feed
+    so that they are only fetched again once the plan changes. Plans no longer in
+    the progress feed are dropped on save. The source organisations of a country,
+    from which child organisations are looked up, are refetched once they are older
+    than childorgs_ttl. The whole cache is discarded if its format version changes.
+
+    Args:
+        path (str): Path to cache file
+        childorgs_ttl (int): Seconds before source organisations are refetched. Defaults to 86400.
+    """
+
+    version = 1
+
+    def __init__(self, path, childorgs_ttl=86400):
+        self.path = path
+        self.childorgs_ttl = childorgs_ttl
+        self.lock = Lock()
+        self.plans = dict()
+        self.organisations = dict()
+        self.seen = set()
+        self.hits = 0
+        self.misses = 0
+        if exists(path):
+            data = load_json(path)
+            if data.get("version") == self.version:
+                self.plans = data["plans"]
+                self.organisations = data["organisations"]
+            else:
+                logger.info(f"Ignoring {path} from a different version")
+
+    @staticmethod
+    def get_plan_key(plan):
+        return get_hash(
+            {
+                "updatedAt": plan.get("updatedAt"),
+                "requirements": plan.get("requirements"),
+                "funding": plan.get("funding"),
+            }
+        )
+
+    def get_plan_data(self, plan, kind, fetch):
+        """Get the data of kind (eg. location) for plan calling fetch if it is not
+        cached for the plan as it is in the progress feed"""
+        plan_id = str(plan["id"])
+        key = self.get_plan_key(plan)
+        with self.lock:
+            self.seen.add(plan_id)
+            entry = self.plans.get(plan_id)
+            if entry is None or entry["key"] != key:
+                entry = {"key": key}
+                self.plans[plan_id] = entry
+            data = entry.get(kind)
+            if data is not None:
+                self.hits += 1
+                return data
+        data = fetch()
+        with self.lock:
+            entry[kind] = data
+            self.misses += 1
+        return data
+
+    def get_organisations(self, countryid, year, fetch):
+        """Get the source organisations for a country and year calling fetch if they
+        are not cached or are older than childorgs_ttl"""
+        key = f"{countryid}-{year}"
+        now = time()
+        with self.lock:
+            entry = self.organisations.get(key)
+            if entry and now - entry["fetched"] < self.childorgs_ttl:
+                self.hits += 1
+                return entry["objects"]
+        objects = fetch()
+        with self.lock:
+            self.organisations[key] = {"fetched": now, "objects": objects}
+            self.misses += 1
+        return objects
+
+    def save(self):
+        logger.info(f"FTS cache: {self.hits} hits, {self.misses} misses")
+        self.plans = {
+            plan_id: entry
+            for plan_id, entry in self.plans.items()
+            if plan_id in self.seen
+        }
+        folder = dirname(self.path)
+        if folder:
+            makedirs(folder, exist_ok=True)
+        data = {
+            "version": self.version,
+            "plans": self.plans,
+            "organisations": self.organisations,
+        }
+        partial_path = f"{self.path}.part"
+        with open(partial_path, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        replace(partial_path, self.path)
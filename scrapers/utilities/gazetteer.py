@@ -0,0 +1,124 @@
+import csv
+import logging
+import pickle
+import sys
+from os import makedirs, replace
+from os.path import dirname, exists, join
+
+from hdx.location import __version__ as location_version
+from hdx.location.adminlevel import AdminLevel
+from hdx.utilities.loader import load_yaml
+
+from .snapshots import get_file_hash, get_hash
+
+logger = logging.getLogger(__name__)
+
+# Attributes of AdminLevel set from the admin configuration and built from the
+# gazetteer, both of which are held in the index
+configuration_attributes = (
+    "admin_level_overrides",
+    "admin_name_mappings",
+    "admin_name_replacements",
+    "admin_fuzzy_dont",
+)
+index_attributes = configuration_attributes + (
+    "pcodes",
+    "pcode_lengths",
+    "name_to_pcode",
+    "pcode_to_name",
+    "pcode_to_iso3",
+)
+
+
+class Gazetteer:
+    """Admin units held in a CSV file with columns country, iso3, pcode and name.
+    They are compiled along with the admin configuration (name mappings,
+    replacements, words not to fuzzy match and admin level overrides) into a pickled
+    index of the lookups that AdminLevel builds, so that startup does not need to
+    parse and index every unit. The index is rebuilt if the CSV, the admin
+    configuration or the location library version change. The index is only kept
+    between runs if an index path is given, which should be in the cache folder
+    rather than the source tree since loading a pickle runs code from it.
+
+    Args:
+        path (str): Path to gazetteer CSV
+        index_path (Optional[str]): Path to compiled index. Defaults to None.
+    """
+
+    index_version = 1
+
+    def __init__(self, path, index_path=None):
+        self.path = path
+        self.index_path = index_path
+        self.hash = get_file_hash(path)
+
+    def read(self):
+        with open(self.path, encoding="utf-8", newline="") as f:
+            return list(csv.DictReader(f))
+
+    def get_key(self, adminlevel):
+        configuration = {
+            "index_version": self.index_version,
+            "location_version": location_version,
+            "gazetteer": self.hash,
+            "admin_level": adminlevel.admin_level,
+        }
+        for attribute in configuration_attributes:
+            configuration[attribute] = getattr(adminlevel, attribute)
+        return get_hash(configuration)
+
+    def load_index(self, key):
+        if not self.index_path or not exists(self.index_path):
+            return None
+        with open(self.index_path, "rb") as f:
+            index = pickle.load(f)
+        if index["key"] != key:
+            logger.info(f"Admin configuration changed so rebuilding {self.index_path}")
+            return None
+        return index
+
+    def build_index(self, adminlevel, key):
+        adminlevel.setup_from_admin_info(self.read())
+        index = {x: getattr(adminlevel, x) for x in index_attributes}
+        index["key"] = key
+        if not self.index_path:
+            return index
+        folder = dirname(self.index_path)
+        if folder:
+            makedirs(folder, exist_ok=True)
+        partial_path = f"{self.index_path}.part"
+        with open(partial_path, "wb") as f:
+            pickle.dump(index, f, protocol=pickle.HIGHEST_PROTOCOL)
+        replace(partial_path, self.index_path)
+        logger.info(f"Compiled gazetteer {self.path} into {self.index_path}")
+        return index
+
+    def setup(self, adminlevel):
+        """Set up adminlevel from the index, compiling it first if needed"""
+        key = self.get_key(adminlevel)
+        index = self.load_index(key)
+        if index is None:
+            self.build_index(adminlevel, key)
+            return
+        for attribute in index_attributes:
+            setattr(adminlevel, attribute, index[attribute])
+
+
+def build(configuration_path, cache_folder, level="admin2"):
+    """Compile the index of the gazetteer for the given level in the project
+    configuration into the cache folder"""
+    admin_configuration = load_yaml(configuration_path)[level]
+    gazetteer = Gazetteer(
+        admin_configuration["gazetteer"],
+        join(cache_folder, admin_configuration["index"]),
+    )
+    adminlevel = AdminLevel(
+        admin_configuration,
+        admin_configuration["admin_level"],
+        admin_configuration["admin_level_overrides"],
+    )
+    gazetteer.build_index(adminlevel, gazetteer.get_key(adminlevel))
+
+
+if __name__ == "__main__":
+    build(join("config", "project_configuration.yml"), sys.argv[1])
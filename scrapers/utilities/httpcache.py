@@ -0,0 +1,528 @@
+import hashlib
+import json
+import logging
+from copy import deepcopy
+from os import close, makedirs, remove, replace
+from os.path import basename, exists, getsize, join, splitext
+from shutil import copyfile
+from tempfile import mkstemp
+from threading import Lock
+from time import time
+
+from hdx.scraper.utilities.reader import Read
+from hdx.utilities.base_downloader import DownloadError
+from hdx.utilities.loader import load_json, load_text, load_yaml
+
+from .parallel import map_threaded
+from .parsing import ParsePool, get_prefilter
+
+logger = logging.getLogger(__name__)
+
+
+def get_table_key(datasetinfo):
+    """Get a key identifying the table a configurable scraper reads from its
+    configuration"""
+    key = {
+        x: datasetinfo.get(x)
+        for x in ("format", "sheet", "headers", "use_hxl", "compression")
+    }
+    # The url of a resource in an HDX dataset is only known once it is read
+    if "url" in datasetinfo:
+        key["url"] = datasetinfo["url"]
+    else:
+        key["dataset"] = datasetinfo.get("dataset")
+        key["resource"] = datasetinfo.get("resource")
+    return json.dumps(key, sort_keys=True, default=str)
+
+
+class HTTPCache:
+    """Persistent on disk cache of downloaded files keyed by URL. A cached file
+    younger than the TTL for the source that downloaded it is used as is, otherwise
+    it is revalidated with If-None-Match and If-Modified-Since. When the cache grows
+    beyond max_size, the least recently used files are evicted on save.
+
+    Args:
+        folder (str): Folder in which to keep cached files
+        max_size_mb (int): Maximum size of cache in megabytes. Defaults to 1024.
+        default_ttl (int): Seconds before a cached file is revalidated. Defaults to 0.
+        ttls (Optional[Dict[str, int]]): Mapping from source (reader prefix) to TTL. Defaults to None.
+    """
+
+    def __init__(self, folder, max_size_mb=1024, default_ttl=0, ttls=None):
+        self.folder = folder
+        self.max_size = max_size_mb * 1024 * 1024
+        self.default_ttl = default_ttl
+        self.ttls = ttls or dict()
+        self.index_path = join(folder, "index.json")
+        self.lock = Lock()
+        self.entries = dict()
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+        makedirs(folder, exist_ok=True)
+        if exists(self.index_path):
+            self.entries = load_json(self.index_path)
+
+    def get_ttl(self, name):
+        return self.ttls.get(name, self.default_ttl)
+
+    def get_entry(self, url):
+        with self.lock:
+            entry = self.entries.get(url)
+        if entry is None or not exists(join(self.folder, entry["file"])):
+            return None
+        return entry
+
+    def set_entry(self, url, entry, status):
+        """Set the entry for url counting whether it was a hit, revalidated or a
+        miss. Downloads are made from several threads so counting is locked too."""
+        with self.lock:
+            self.entries[url] = entry
+            if status == "hit":
+                self.hits += 1
+            elif status == "revalidated":
+                self.revalidated += 1
+            else:
+                self.misses += 1
+
+    def download(self, downloader, url, filename, name, **kwargs):
+        """Download url using downloader returning the path to the cached file and
+        whether it was a hit, revalidated or a miss"""
+        now = time()
+        entry = self.get_entry(url)
+        headers = dict(kwargs.get("headers") or {})
+        if entry:
+            path = join(self.folder, entry["file"])
+            if now - entry["fetched"] < self.get_ttl(name):
+                logger.info(f"Using cached {filename} in {path}")
+                self.set_entry(url, dict(entry, accessed=now), "hit")
+                return path, "hit"
+            if entry["etag"]:
+                headers["If-None-Match"] = entry["etag"]
+            if entry["last_modified"]:
+                headers["If-Modified-Since"] = entry["last_modified"]
+        downloader.setup(
+            url,
+            stream=True,
+            parameters=kwargs.get("parameters"),
+            timeout=kwargs.get("timeout"),
+            headers=headers,
+            encoding=kwargs.get("encoding"),
+        )
+        if entry and downloader.get_status() == 304:
+            downloader.response.close()
+            logger.info(f"Cached {filename} in {path} is unchanged")
+            self.set_entry(url, dict(entry, fetched=now, accessed=now), "revalidated")
+            return path, "revalidated"
+        digest = hashlib.sha256(url.encode("utf-8")).hexdigest()
+        file = f"{digest}{splitext(filename)[1]}"
+        path = join(self.folder, file)
+        # Download next to the cached file then swap it in so that an interrupted
+        # download never leaves a partial file in the cache. Each download has its
+        # own partial file as the same URL can be downloaded by two threads at once.
+        fd, partial_path = mkstemp(
+            suffix=".part", prefix=f"{basename(path)}.", dir=self.folder
+        )
+        close(fd)
+        try:
+            downloader.stream_path(
+                partial_path, f"Download of {url} failed in retrieval of stream!"
+            )
+            replace(partial_path, path)
+        finally:
+            if exists(partial_path):
+                remove(partial_path)
+        logger.info(f"Cached {filename} in {path}")
+        entry = {
+            "file": file,
+            "etag": downloader.get_header("ETag"),
+            "last_modified": downloader.get_header("Last-Modified"),
+            "fetched": now,
+            "accessed": now,
+            "size": getsize(path),
+        }
+        self.set_entry(url, entry, "miss")
+        return path, "miss"
+
+    def evict(self):
+        size = sum(entry["size"] for entry in self.entries.values())
+        if size <= self.max_size:
+            return
+        entries = sorted(self.entries.items(), key=lambda x: x[1]["accessed"])
+        for url, entry in entries:
+            if size <= self.max_size:
+                break
+            path = join(self.folder, entry["file"])
+            if exists(path):
+                remove(path)
+            del self.entries[url]
+            size -= entry["size"]
+            logger.info(f"Evicted {url} from HTTP cache")
+
+    def save(self):
+        with self.lock:
+            self.evict()
+            partial_path = f"{self.index_path}.part"
+            with open(partial_path, "w", encoding="utf-8") as f:
+                json.dump(self.entries, f)
+            replace(partial_path, self.index_path)
+
+    def output_cache_stats(self):
+        line = f"HTTP cache: {self.hits} hits, {self.revalidated} revalidated, "
+        line = f"{line}{self.misses} misses"
+        logger.info(line)
+        return line
+
+
+class CachedRead(Read):
+    """Read that downloads through an HTTPCache when one has been set up with
+    create_readers. Saved data and POST requests bypass the cache. If downloads is
+    set to a dictionary, the files downloaded are recorded in it by reader prefix.
+    HDX datasets are memoised for the run so that each is only read once. If
+    share_downloads is set, files and JSON are also memoised by URL so that profiles
+    run in the same process only download them once. If metrics are set up,
+    requests, bytes downloaded, cache hits and rows read are counted by reader
+    prefix. Tabular sources with parse_in_process set are parsed and prefiltered in
+    the parse pool. Tables set up with share_tables are only downloaded and parsed
+    once and each scraper reading them gets its own copy of the rows along with the
+    table's downloads. Scrapers that will not read a shared table must release it."""
+
+    http_cache = None
+    metrics = None
+    downloads = None
+    datasets = dict()
+    dataset_locks = dict()
+    shared = None
+    shared_locks = dict()
+    parse_pool = ParsePool()
+    shared_tables = dict()
+    scraper_table_reads = dict()
+    table_reads = dict()
+    tables = dict()
+    table_locks = dict()
+
+    @classmethod
+    def create_readers(
+        cls,
+        *args,
+        http_cache=None,
+        metrics=None,
+        share_downloads=False,
+        parse_workers=0,
+        **kwargs,
+    ):
+        cls.http_cache = http_cache
+        cls.metrics = metrics
+        cls.datasets = dict()
+        cls.dataset_locks = dict()
+        cls.shared = dict() if share_downloads else None
+        cls.shared_locks = dict()
+        cls.parse_pool.close()
+        cls.parse_pool = ParsePool(parse_workers)
+        cls.share_tables(())
+        super().create_readers(*args, **kwargs)
+        # Scrapers look up readers on Read
+        Read.retrievers = cls.retrievers
+
+    def clone(self, downloader):
+        return CachedRead(
+            downloader,
+            fallback_dir=self.fallback_dir,
+            saved_dir=self.saved_dir,
+            temp_dir=self.temp_dir,
+            save=self.save,
+            use_saved=self.use_saved,
+            prefix=self.prefix,
+            delete=False,
+            today=self.today,
+        )
+
+    def read_dataset(self, dataset_name):
+        with self.dataset_locks.setdefault(dataset_name, Lock()):
+            if dataset_name not in self.datasets:
+                self.datasets[dataset_name] = super().read_dataset(dataset_name)
+                if not self.use_saved:
+                    self.add_metrics(self.prefix, requests=1)
+            return self.datasets[dataset_name]
+
+    def read_datasets(self, dataset_names, max_workers=1):
+        """Read HDX datasets concurrently"""
+        return map_threaded(self.read_dataset, dataset_names, max_workers)
+
+    def add_metrics(self, name, **counts):
+        if self.metrics:
+            self.metrics.add("sources", name, **counts)
+
+    def use_cache(self, kwargs):
+        return self.http_cache and not self.use_saved and not kwargs.get("post")
+
+    def get_shared_key(self, kind, url, kwargs):
+        # Saved data needs every reader to save its own copy
+        if self.shared is None or self.save or self.use_saved:
+            return None
+        kwargs = {k: v for k, v in kwargs.items() if k != "file_prefix"}
+        return kind, url, json.dumps(kwargs, sort_keys=True, default=str)
+
+    def get_shared(self, key, name, function):
+        """Return the result of function, which is only called once for any key"""
+        with self.shared_locks.setdefault(key, Lock()):
+            if key in self.shared:
+                self.add_metrics(name, cache_hits=1)
+            else:
+                self.shared[key] = function()
+            return self.shared[key]
+
+    def download_file(
+        self, url, filename=None, logstr=None, fallback=False, log_level=None, **kwargs
+    ):
+        name = kwargs.get("file_prefix") or self.prefix
+        key = self.get_shared_key("file", url, dict(kwargs, filename=filename))
+        if key:
+            path = self.get_shared(
+                key,
+                name,
+                lambda: self.download_unshared_file(
+                    url, filename, logstr, fallback, log_level, name, **kwargs
+                ),
+            )
+        else:
+            path = self.download_unshared_file(
+                url, filename, logstr, fallback, log_level, name, **kwargs
+            )
+        if self.downloads is not None:
+            filename, _ = self.get_filename(url, filename, **kwargs)
+            self.downloads.setdefault(name, dict())[url] = (filename, path)
+        return path
+
+    def download_unshared_file(
+        self, url, filename, logstr, fallback, log_level, name, **kwargs
+    ):
+        if self.use_cache(kwargs):
+            filename, kwargs = self.get_filename(url, filename, **kwargs)
+            return self.download_from_cache(
+                url, filename, logstr, fallback, name, **kwargs
+            )
+        path = super().download_file(
+            url, filename, logstr, fallback, log_level, **kwargs
+        )
+        if not self.use_saved:
+            self.add_metrics(name, requests=1, bytes=getsize(path))
+        return path
+
+    def download_from_cache(self, url, filename, logstr, fallback, name, **kwargs):
+        if not logstr:
+            logstr = filename
+        try:
+            path, status = self.http_cache.download(
+                self.downloader, url, filename, name, **kwargs
+            )
+        except DownloadError:
+            if not fallback:
+                raise
+            fallback_path = join(self.fallback_dir, filename)
+            logger.exception(
+                f"{logstr} download failed, using static data {fallback_path}!"
+            )
+            return fallback_path
+        if status == "hit":
+            self.add_metrics(name, cache_hits=1)
+        elif status == "revalidated":
+            self.add_metrics(name, requests=1, cache_hits=1)
+        else:
+            self.add_metrics(name, requests=1, bytes=getsize(path))
+        if not self.save:
+            return path
+        saved_path = join(self.saved_dir, filename)
+        copyfile(path, saved_path)
+        return saved_path
+
+    def download_cached(self, load, url, filename, extensions, logstr, **kwargs):
+        # Work out the filename as the uncached method would so saved data matches
+        filename, kwargs = self.get_filename(url, filename, extensions, **kwargs)
+        kwargs["file_prefix"] = ""
+        return load(self.download_file(url, filename, logstr, **kwargs))
+
+    def add_response_metrics(self):
+        # Data loaded from text, YAML or JSON is held in the response
+        response = self.downloader.response
+        if self.use_saved or response is None:
+            return
+        self.add_metrics(self.prefix, requests=1, bytes=len(response.content))
+
+    def download_text(self, url, filename=None, logstr=None, **kwargs):
+        if not self.use_cache(kwargs):
+            text = super().download_text(url, filename, logstr, **kwargs)
+            self.add_response_metrics()
+            return text
+        return self.download_cached(load_text, url, filename, (), logstr, **kwargs)
+
+    def download_yaml(self, url, filename=None, logstr=None, **kwargs):
+        if not self.use_cache(kwargs):
+            ryaml = super().download_yaml(url, filename, logstr, **kwargs)
+            self.add_response_metrics()
+            return ryaml
+        return self.download_cached(
+            load_yaml, url, filename, ("yaml", "yml"), logstr, **kwargs
+        )
+
+    def download_json(self, url, filename=None, logstr=None, **kwargs):
+        if not self.use_cache(kwargs):
+            key = self.get_shared_key("json", url, kwargs)
+            if not key:
+                return self.download_unshared_json(url, filename, logstr, **kwargs)
+            # Callers can change what they are given so they each get a copy
+            return deepcopy(
+                self.get_shared(
+                    key,
+                    self.prefix,
+                    lambda: self.download_unshared_json(
+                        url, filename, logstr, **kwargs
+                    ),
+                )
+            )
+        return self.download_cached(
+            load_json, url, filename, ("json",), logstr, **kwargs
+        )
+
+    def download_unshared_json(self, url, filename=None, logstr=None, **kwargs):
+        rjson = super().download_json(url, filename, logstr, **kwargs)
+        self.add_response_metrics()
+        return rjson
+
+    def count_rows(self, iterator):
+        rows = 0
+        try:
+            for row in iterator:
+                rows += 1
+                yield row
+        finally:
+            self.add_metrics(self.prefix, rows_in=rows)
+
+    @classmethod
+    def share_tables(cls, configurations):
+        """Share tables read more than once by the configurable scrapers in the given
+        configurations, which are looked up by reader prefix (scraper name)"""
+        keys = dict()
+        scraper_reads = dict()
+        reads = dict()
+        for configuration in configurations:
+            for name, datasetinfo in configuration.items():
+                key = get_table_key(datasetinfo)
+                keys[name] = key
+                # Scrapers with HXL hashtags but no outputs also read their headers
+                if datasetinfo.get("use_hxl") and not datasetinfo.get("output"):
+                    no_reads = 2
+                else:
+                    no_reads = 1
+                scraper_reads[name] = no_reads
+                reads[key] = reads.get(key, 0) + no_reads
+        cls.shared_tables = {
+            name: key for name, key in keys.items() if reads[key] > 1
+        }
+        cls.scraper_table_reads = scraper_reads
+        cls.table_reads = reads
+        cls.tables = dict()
+        cls.table_locks = dict()
+
+    def read(self, datasetinfo, **kwargs):
+        # Saved data needs every reader to save its own copy
+        key = self.shared_tables.get(self.prefix)
+        if key and not self.save:
+            kwargs["shared_table"] = key
+        return super().read(datasetinfo, **kwargs)
+
+    def get_table(self, key, read):
+        """Return the headers and rows of a shared table calling read if it has not
+        been read yet. The files downloaded to read the table are recorded as
+        downloads of every scraper that reads it. The table is dropped once it has
+        been read as many times as expected."""
+        with self.table_locks.setdefault(key, Lock()):
+            table = self.tables.get(key)
+            if table is None:
+                if self.downloads is None:
+                    before = None
+                else:
+                    before = dict(self.downloads.get(self.prefix, {}))
+                headers, iterator = read()
+                rows = list(iterator)
+                if before is None:
+                    downloads = dict()
+                else:
+                    downloads = {
+                        url: download
+                        for url, download in self.downloads.get(self.prefix, {}).items()
+                        if before.get(url) != download
+                    }
+                table = [headers, rows, self.table_reads[key], downloads]
+                self.tables[key] = table
+            else:
+                self.add_metrics(self.prefix, cache_hits=1)
+                if self.downloads is not None:
+                    self.downloads.setdefault(self.prefix, dict()).update(table[3])
+            table[2] -= 1
+            if table[2] == 0:
+                del self.tables[key]
+        headers, rows, _, _ = table
+        # Rows are changed by the scrapers that read them
+        return list(headers), (dict(row) for row in rows)
+
+    @classmethod
+    def release_table(cls, name):
+        """Release the shared table that the scraper with the given name (reader
+        prefix) would have read, for example because its values were restored, so
+        that the table is not kept waiting for it"""
+        key = cls.shared_tables.get(name)
+        if not key:
+            return
+        no_reads = cls.scraper_table_reads[name]
+        with cls.table_locks.setdefault(key, Lock()):
+            cls.table_reads[key] -= no_reads
+            table = cls.tables.get(key)
+            if table is None:
+                return
+            table[2] -= no_reads
+            if table[2] <= 0:
+                del cls.tables[key]
+
+    def read_tabular(self, datasetinfo, **kwargs):
+        key = kwargs.pop("shared_table", None)
+        # Lists of URLs are not supported as their parameters are templated
+        if datasetinfo.get("parse_in_process") and isinstance(datasetinfo["url"], str):
+            # Shared tables are prefiltered by each scraper that reads them
+            kwargs["parse_prefilter"] = None if key else get_prefilter(datasetinfo)
+        if not key:
+            return super().read_tabular(datasetinfo, **kwargs)
+        return self.get_table(
+            key, lambda: super(CachedRead, self).read_tabular(datasetinfo, **kwargs)
+        )
+
+    def parse_in_process(
+        self, url, has_hxl, headers, filename, logstr, fallback, prefilter, **kwargs
+    ):
+        path = self.download_file(url, filename, logstr, fallback, **kwargs)
+        kwargs.pop("file_prefix", None)
+        return self.parse_pool.parse(path, has_hxl, headers, prefilter, kwargs)
+
+    def get_tabular_rows(
+        self,
+        url,
+        has_hxl=False,
+        headers=1,
+        dict_form=False,
+        filename=None,
+        logstr=None,
+        fallback=False,
+        **kwargs,
+    ):
+        if "parse_prefilter" in kwargs:
+            prefilter = kwargs.pop("parse_prefilter")
+            headers, iterator = self.parse_in_process(
+                url, has_hxl, headers, filename, logstr, fallback, prefilter, **kwargs
+            )
+        else:
+            headers, iterator = super().get_tabular_rows(
+                url, has_hxl, headers, dict_form, filename, logstr, fallback, **kwargs
+            )
+        if not self.metrics:
+            return headers, iterator
+        return headers, self.count_rows(iterator)
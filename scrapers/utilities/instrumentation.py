@@ -0,0 +1,192 @@
+import json
+import logging
+from contextlib import contextmanager
+from os import makedirs, replace
+from os.path import dirname
+from threading import Lock
+from time import perf_counter
+
+from hdx.utilities.dateparse import now_utc
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+prometheus_prefix = "hornafrica_viz"
+
+
+def get_maxrss():
+    """Peak resident memory of the process in kilobytes (0 if not available)"""
+    if resource is None:
+        return 0
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def count_rows(scraper):
+    """Number of admin units (or regional rows) that a scraper has values for"""
+    rows = 0
+    for values in scraper.values.values():
+        keys = set()
+        for value in values:
+            keys.update(value)
+        rows += len(keys)
+    return rows
+
+
+def write_atomically(text, path):
+    folder = dirname(path)
+    if folder:
+        makedirs(folder, exist_ok=True)
+    partial_path = f"{path}.part"
+    with open(partial_path, "w", encoding="utf-8") as f:
+        f.write(text)
+    replace(partial_path, path)
+
+
+def escape_label(value):
+    """Escape a Prometheus label value"""
+    value = str(value).replace("\\", "\\\\").replace('"', '\\"')
+    return value.replace("\n", "\\n")
+
+
+class RunMetrics:
+    """Thread safe collection of timings and counts for a run. Counts are kept in
+    sections (stages, scrapers, sources and outputs) by key and are summed when the
+    same key is recorded more than once. When profile is set, counts are kept apart
+    for that profile rather than summed with those of other profiles. Memory is the
+    increase in the peak resident memory of the whole process while something was
+    measured, so when scrapers run concurrently it is attributed to whichever raised
+    the peak."""
+
+    sections = ("stages", "scrapers", "sources", "outputs")
+
+    def __init__(self):
+        self.lock = Lock()
+        self.started = now_utc()
+        self.start = perf_counter()
+        self.start_maxrss = get_maxrss()
+        self.profile = None
+        self.metrics = {section: dict() for section in self.sections}
+        self.profiles = dict()
+
+    def add(self, section, key, **fields):
+        self.add_to_profile(self.profile, section, key, fields)
+
+    def add_to_profile(self, profile, section, key, fields):
+        with self.lock:
+            if profile is None:
+                metrics = self.metrics
+            else:
+                metrics = self.profiles.setdefault(
+                    profile, {section: dict() for section in self.sections}
+                )
+            record = metrics[section].setdefault(key, dict())
+            for field, value in fields.items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    record[field] = record.get(field, 0) + value
+                else:
+                    record[field] = value
+
+    @contextmanager
+    def measure(self, section, key, **fields):
+        """Time what runs in the with block. The yielded dictionary can be updated
+        with fields to record alongside the timing."""
+        profile = self.profile
+        start = perf_counter()
+        maxrss = get_maxrss()
+        record = dict(fields)
+        try:
+            yield record
+        finally:
+            record["calls"] = 1
+            record["seconds"] = perf_counter() - start
+            record["maxrss_delta_kb"] = get_maxrss() - maxrss
+            self.add_to_profile(profile, section, key, record)
+
+    @staticmethod
+    def get_sections(metrics):
+        return {
+            section: {key: dict(records[key]) for key in sorted(records)}
+            for section, records in metrics.items()
+        }
+
+    def get_report(self, http_cache=None):
+        report = {
+            "started": self.started.isoformat(),
+            "seconds": perf_counter() - self.start,
+            "maxrss_kb": get_maxrss(),
+            "maxrss_delta_kb": get_maxrss() - self.start_maxrss,
+        }
+        if http_cache:
+            report["http_cache"] = {
+                "hits": http_cache.hits,
+                "revalidated": http_cache.revalidated,
+                "misses": http_cache.misses,
+            }
+        with self.lock:
+            report.update(self.get_sections(self.metrics))
+            if self.profiles:
+                report["profiles"] = {
+                    profile: self.get_sections(self.profiles[profile])
+                    for profile in sorted(self.profiles)
+                }
+        return report
+
+    def get_prometheus(self, report):
+        """Convert a report into the Prometheus text format"""
+        lines = list()
+
+        def add_metric(name, value, labels=None):
+            if isinstance(value, bool):
+                value = int(value)
+            if not isinstance(value, (int, float)):
+                return
+            name = f"{prometheus_prefix}_{name}"
+            if labels:
+                labels = ",".join(f'{k}="{escape_label(v)}"' for k, v in labels.items())
+                name = f"{name}{{{labels}}}"
+            lines.append(f"{name} {value}")
+
+        def add_sections(sections, profile_labels):
+            labels = {"stages": "stage", "scrapers": "scraper", "sources": "source"}
+            for section, label in labels.items():
+                for key, record in sections[section].items():
+                    for field, value in record.items():
+                        labels = {**profile_labels, label: key}
+                        add_metric(f"{section[:-1]}_{field}", value, labels)
+            for key, record in sections["outputs"].items():
+                output, method = key.split(".")
+                for field, value in record.items():
+                    labels = {**profile_labels, "output": output, "method": method}
+                    add_metric(f"output_{field}", value, labels)
+
+        for field in ("seconds", "maxrss_kb", "maxrss_delta_kb"):
+            add_metric(f"run_{field}", report[field])
+        for field, value in report.get("http_cache", {}).items():
+            add_metric(f"http_cache_{field}", value)
+        add_sections(report, dict())
+        for profile, sections in report.get("profiles", {}).items():
+            add_sections(sections, {"profile": profile})
+        lines.sort()
+        return "\n".join(lines) + "\n"
+
+    def save(self, report_path=None, prometheus_path=None, http_cache=None):
+        """Save a JSON run report and/or a Prometheus textfile"""
+        report = self.get_report(http_cache)
+        scrapers = list(report["scrapers"].items())
+        for profile, sections in report.get("profiles", {}).items():
+            for name, record in sections["scrapers"].items():
+                scrapers.append((f"{name} ({profile})", record))
+        slowest = sorted(scrapers, key=lambda x: x[1]["seconds"], reverse=True)
+        for name, record in slowest[:5]:
+            logger.info(f"Scraper {name} took {record['seconds']:.1f}s")
+        if report_path:
+            logger.info(f"Writing run report to {report_path}")
+            write_atomically(json.dumps(report, indent=2), report_path)
+        if prometheus_path:
+            logger.info(f"Writing Prometheus metrics to {prometheus_path}")
+            write_atomically(self.get_prometheus(report), prometheus_path)
+        return report
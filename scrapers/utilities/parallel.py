@@ -0,0 +1,37 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from hdx.utilities.downloader import Download
+from ratelimit import RateLimitDecorator, sleep_and_retry
+
+
+def get_rate_limiter(downloader):
+    """Get the RateLimitDecorator that the setup of downloader is rate limited with
+    or None if it is not rate limited"""
+    rate_limiter = getattr(downloader, "rate_limiter", None)
+    if rate_limiter is not None:
+        return rate_limiter
+    # Download wraps its setup in sleep_and_retry and a RateLimitDecorator when it
+    # is given a rate limit
+    wrapper = getattr(downloader.setup, "__wrapped__", None)
+    for cell in getattr(wrapper, "__closure__", None) or ():
+        if isinstance(cell.cell_contents, RateLimitDecorator):
+            return cell.cell_contents
+    return None
+
+
+def clone_reader(reader):
+    # A Download object keeps hold of its current response so it cannot be shared
+    # between threads, but the clones can share the session and its connection pool
+    downloader = Download(session=reader.downloader.session)
+    rate_limiter = get_rate_limiter(reader.downloader)
+    if rate_limiter is not None:
+        # Clones count towards the rate limit of the reader they are cloned from
+        downloader.rate_limiter = rate_limiter
+        downloader.setup = sleep_and_retry(rate_limiter(downloader.normal_setup))
+    return reader.clone(downloader)
+
+
+def map_threaded(function, iterable, max_workers):
+    # Results are returned in the order of iterable regardless of completion order
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(function, iterable))
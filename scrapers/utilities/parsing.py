@@ -0,0 +1,91 @@
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from types import SimpleNamespace
+
+from hdx.scraper.configurable import rowparser
+from hdx.scraper.configurable.rowparser import RowParser
+from hdx.utilities.downloader import Download
+
+from .expressions import compile_expression
+
+logger = logging.getLogger(__name__)
+
+
+def get_prefilter(datasetinfo):
+    """Get the prefilter of a configurable scraper as an expression on row as
+    RowParser would evaluate it or None if it cannot be applied to the rows as read
+    from the file"""
+    prefilter = datasetinfo.get("prefilter")
+    if not prefilter:
+        return None
+    # These change the rows or their keys before RowParser applies the prefilter
+    for key in ("use_hxl", "stop_row", "flatten", "subsets"):
+        if datasetinfo.get(key):
+            return None
+    # Columns are substituted exactly as RowParser does it since they need not be
+    # valid names (eg. Year Week)
+    parser = SimpleNamespace(
+        filter_cols=datasetinfo.get("filter_cols", []),
+        datecol=datasetinfo.get("date"),
+        subsets=[{"input": datasetinfo.get("input", [])}],
+    )
+    return RowParser.get_filter_str_for_eval(parser, prefilter)
+
+
+def parse_tabular(path, has_hxl, headers, prefilter, kwargs):
+    """Parse the tabular file at path keeping only rows for which prefilter is true.
+    Returns the headers and the rows as a list of columns, which is much smaller to
+    send back from a worker process than a list of dictionaries. The prefilter is
+    compiled as CompiledRowParser compiles it so that it gives the same result in a
+    worker process as in the calling thread."""
+    with Download(user_agent="hdx-scraper-hornafrica-viz") as downloader:
+        file_headers, iterator = downloader.get_tabular_rows(
+            path, has_hxl, headers, True, **kwargs
+        )
+        if prefilter:
+            function = compile_expression(prefilter, "row", rowparser)
+            iterator = (row for row in iterator if function(row))
+        columns = [list() for _ in file_headers]
+        for row in iterator:
+            for i, header in enumerate(file_headers):
+                columns[i].append(row.get(header))
+    return file_headers, columns
+
+
+def get_rows(headers, columns):
+    """Turn columns returned by parse_tabular back into rows"""
+    for values in zip(*columns):
+        yield dict(zip(headers, values))
+
+
+class ParsePool:
+    """Pool of worker processes in which to parse tabular files. With no workers,
+    files are parsed in the calling thread.
+
+    Args:
+        max_workers (int): Number of worker processes. Defaults to 0.
+    """
+
+    def __init__(self, max_workers=0):
+        self.executor = None
+        if max_workers:
+            # Forking a process that has threads running can deadlock
+            self.executor = ProcessPoolExecutor(
+                max_workers, mp_context=get_context("spawn")
+            )
+
+    def parse(self, path, has_hxl, headers, prefilter, kwargs):
+        """Parse the tabular file at path returning its headers and an iterator of
+        rows as dictionaries"""
+        args = (path, has_hxl, headers, prefilter, kwargs)
+        if self.executor:
+            file_headers, columns = self.executor.submit(parse_tabular, *args).result()
+        else:
+            file_headers, columns = parse_tabular(*args)
+        return file_headers, get_rows(file_headers, columns)
+
+    def close(self):
+        if self.executor:
+            self.executor.shutdown()
+            self.executor = None
@@ -0,0 +1,40 @@
+from copy import deepcopy
+from os.path import splitext
+
+
+def get_profile_configuration(configuration, profile):
+    """Get the configuration for a profile (eg. a region) as a copy of the project
+    configuration with the keys given for the profile in the profiles section
+    replaced. Where both values are dictionaries, the profile's keys are merged into
+    a copy of the project's. Each profile writes its own JSON output, which unless
+    the profile sets it is the project's with the profile name added as for Excel.
+    Spreadsheets cannot be derived like this so a profile only has those it sets."""
+    profile_configuration = deepcopy(configuration.data)
+    overrides = deepcopy(configuration["profiles"][profile])
+    for key, value in overrides.items():
+        original = profile_configuration.get(key)
+        if isinstance(original, dict) and isinstance(value, dict):
+            original.update(value)
+        else:
+            profile_configuration[key] = value
+    if "output" not in overrides.get("json", {}):
+        root, extension = splitext(profile_configuration["json"]["output"])
+        profile_configuration["json"]["output"] = f"{root}_{profile}{extension}"
+    if "googlesheets" not in overrides:
+        profile_configuration["googlesheets"] = dict()
+    return profile_configuration
+
+
+def check_profiles(configuration, profiles, gsheet_auth=None):
+    """Check that the profiles exist and, if Google Sheets are to be updated, that
+    each sets its own spreadsheets so that one profile does not overwrite another's.
+    Raises ValueError if not."""
+    for profile in profiles:
+        overrides = configuration["profiles"].get(profile)
+        if overrides is None:
+            raise ValueError(f"Profile {profile} is not configured!")
+        if gsheet_auth and not overrides.get("googlesheets"):
+            raise ValueError(
+                f"Profile {profile} must set its own googlesheets to update Google "
+                "Sheets!"
+            )
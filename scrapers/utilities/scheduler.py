@@ -0,0 +1,127 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from threading import BoundedSemaphore
+from urllib.parse import urlsplit
+
+from hdx.scraper.utilities.reader import Read
+
+from .instrumentation import count_rows
+from .parallel import clone_reader
+
+logger = logging.getLogger(__name__)
+
+hdx_host = "data.humdata.org"
+
+
+class Scheduler:
+    """Run the scrapers added to a Runner on a pool of worker threads. Scrapers are
+    run in stages where each stage starts once every scraper in the previous one
+    has finished, which is how dependencies like population or the regional
+    aggregation of national values are respected. host_limits caps how many
+    scrapers reading from a given remote host run at the same time.
+
+    Args:
+        runner (Runner): Runner with scrapers added
+        max_workers (int): Maximum number of scrapers to run at once. Defaults to 1.
+        host_limits (Optional[Dict[str, int]]): Mapping from host to scrapers allowed at once. Defaults to None.
+        snapshots (Optional[ScraperSnapshots]): Snapshots of unchanged scrapers. Defaults to None.
+        metrics (Optional[RunMetrics]): Metrics in which to record timings. Defaults to None.
+    """
+
+    def __init__(
+        self, runner, max_workers=1, host_limits=None, snapshots=None, metrics=None
+    ):
+        self.runner = runner
+        self.max_workers = max_workers
+        self.snapshots = snapshots
+        self.metrics = metrics
+        self.host_semaphores = {
+            host: BoundedSemaphore(limit)
+            for host, limit in (host_limits or dict()).items()
+        }
+
+    def get_host(self, name):
+        datasetinfo = self.runner.get_scraper(name).datasetinfo
+        url = datasetinfo.get("url")
+        if isinstance(url, list):
+            url = url[0]
+        if url:
+            return urlsplit(url).netloc
+        if "dataset" in datasetinfo or "datasets" in datasetinfo:
+            return hdx_host
+        return None
+
+    def run_scraper(self, name):
+        if not self.metrics:
+            return self.run_limited(name)
+        with self.metrics.measure("scrapers", name) as record:
+            has_run = self.run_limited(name)
+            scraper = self.runner.get_scraper(name)
+            record["source"] = scraper.name
+            record["fallbacks_used"] = scraper.fallbacks_used
+            record["rows_out"] = count_rows(scraper)
+        return has_run
+
+    def run_limited(self, name):
+        semaphore = self.host_semaphores.get(self.get_host(name))
+        if semaphore is None:
+            return self.run_or_restore(name)
+        with semaphore:
+            return self.run_or_restore(name)
+
+    def run_or_restore(self, name):
+        if not self.snapshots:
+            return self.runner.run_scraper(name)
+        if self.snapshots.restore(name):
+            if self.metrics:
+                self.metrics.add("scrapers", name, restored=True)
+            return True
+        has_run = self.runner.run_scraper(name)
+        self.snapshots.take(name)
+        return has_run
+
+    def run_stage(self, names, max_workers=None):
+        if max_workers is None:
+            max_workers = self.max_workers
+        if max_workers == 1:
+            for name in names:
+                self.run_scraper(name)
+            return
+        # Readers are looked up by scraper name (without any suffix) and hold state
+        # for the current download, so give every scraper its own one
+        for name in names:
+            reader_name = self.runner.get_scraper(name).name
+            Read.retrievers[reader_name] = clone_reader(Read.get_reader(reader_name))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [executor.submit(self.run_scraper, name) for name in names]
+        for future in futures:
+            future.result()
+
+    def run(self, stages):
+        """Run stages of scrapers in order. Each stage is a tuple of (scraper names,
+        maximum number of workers or None for the default). Scraper names of None
+        means every scraper not in another stage. A scraper in more than one stage
+        is only run in the first of them. Within a stage, scrapers are started in
+        the order they are held in the runner."""
+        scraper_names = self.runner.get_scraper_names()
+        in_stages = set()
+        for names, _ in stages:
+            if names is not None:
+                in_stages.update(names)
+        has_run = set()
+        for i, (names, max_workers) in enumerate(stages):
+            if names is None:
+                names = [name for name in scraper_names if name not in in_stages]
+            else:
+                names = [
+                    name
+                    for name in scraper_names
+                    if name in names and name not in has_run
+                ]
+            has_run.update(names)
+            if not self.metrics:
+                self.run_stage(names, max_workers)
+                continue
+            with self.metrics.measure("stages", f"stage{i + 1}") as record:
+                record["scrapers"] = len(names)
+                self.run_stage(names, max_workers)
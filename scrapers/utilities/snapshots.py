@@ -0,0 +1,148 @@
+import hashlib
+import json
+import logging
+import pickle
+from copy import deepcopy
+from os import makedirs, replace
+from os.path import dirname, exists
+
+from hdx.utilities.base_downloader import DownloadError
+
+from .httpcache import CachedRead
+
+logger = logging.getLogger(__name__)
+
+
+def get_hash(obj):
+    obj = json.dumps(obj, sort_keys=True, default=str)
+    return hashlib.sha256(obj.encode("utf-8")).hexdigest()
+
+
+def get_file_hash(path):
+    filehash = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1048576), b""):
+            filehash.update(chunk)
+    return filehash.hexdigest()
+
+
+class ScraperSnapshots:
+    """Snapshots of the values and sources of scrapers along with hashes of their
+    configuration, HDX metadata and every file they downloaded. If none of these
+    have changed since the last successful run, a scraper's values are restored from
+    its snapshot instead of it being run. Files are fetched again to hash them, so
+    snapshots are only used with the HTTP cache or saved data where that is cheap.
+    Scrapers that did not download anything through a reader are always run.
+    Snapshots are pickled since dataset information holds dates, and loading a
+    pickle can run arbitrary code, so the snapshots file (like everything in the
+    cache folder) must only be writable by those trusted to run the scrapers.
+
+    Args:
+        path (str): Path to snapshots file
+        runner (Runner): Runner with scrapers added
+        names (ListTuple[str]): Names of scrapers that can be skipped
+    """
+
+    def __init__(self, path, runner, names):
+        self.path = path
+        self.runner = runner
+        self.snapshots = dict()
+        if exists(path):
+            with open(path, "rb") as f:
+                self.snapshots = pickle.load(f)
+        # Scrapers change their datasetinfo when they run so keep it from up front
+        self.datasetinfos = {
+            name: deepcopy(runner.get_scraper(name).datasetinfo) for name in names
+        }
+        self.config_hashes = {
+            name: get_hash(datasetinfo)
+            for name, datasetinfo in self.datasetinfos.items()
+        }
+        CachedRead.downloads = dict()
+
+    def get_metadata_hash(self, name, reader):
+        datasetinfo = self.datasetinfos[name]
+        if "dataset" not in datasetinfo:
+            return None
+        datasetinfo = deepcopy(datasetinfo)
+        reader.read_hdx_metadata(datasetinfo)
+        metadata = {
+            key: datasetinfo.get(key)
+            for key in ("url", "source", "source_date", "source_url")
+        }
+        return get_hash(metadata)
+
+    def is_unchanged(self, name):
+        config_hash = self.config_hashes.get(name)
+        snapshot = self.snapshots.get(name)
+        if config_hash is None or snapshot is None:
+            return False
+        if snapshot["config"] != config_hash:
+            return False
+        scraper = self.runner.get_scraper(name)
+        reader = scraper.get_reader()
+        try:
+            if self.get_metadata_hash(name, reader) != snapshot["metadata"]:
+                return False
+            for url, (filename, filehash) in snapshot["inputs"].items():
+                path = reader.download_file(url, filename, file_prefix="")
+                if get_file_hash(path) != filehash:
+                    return False
+        except DownloadError:
+            return False
+        finally:
+            # Only downloads made by the scraper itself are its inputs
+            CachedRead.downloads.pop(scraper.name, None)
+        return True
+
+    def restore(self, name):
+        """Restore values and sources of the scraper with the given name if it would
+        be run and its inputs are unchanged. Returns whether it was restored."""
+        scrapers_to_run = self.runner.scrapers_to_run
+        if scrapers_to_run and not any(x in name for x in scrapers_to_run):
+            return False
+        if not self.is_unchanged(name):
+            return False
+        logger.info(f"Inputs of {name} are unchanged so reusing previous values")
+        snapshot = self.snapshots[name]
+        scraper = self.runner.get_scraper(name)
+        # The scraper will not read any table it shares with other scrapers
+        CachedRead.release_table(scraper.name)
+        # Aggregators get sources from the dataset information of their inputs
+        for key in ("datasetinfo", "headers", "values", "sources", "source_urls"):
+            setattr(scraper, key, deepcopy(snapshot[key]))
+        scraper.add_population()
+        scraper.has_run = True
+        scraper.post_run()
+        return True
+
+    def take(self, name):
+        """Take a snapshot of the scraper with the given name after it has run"""
+        config_hash = self.config_hashes.get(name)
+        if config_hash is None:
+            return
+        scraper = self.runner.get_scraper(name)
+        downloads = CachedRead.downloads.pop(scraper.name, None)
+        if not scraper.has_run or scraper.fallbacks_used or not downloads:
+            self.snapshots.pop(name, None)
+            return
+        inputs = {
+            url: (filename, get_file_hash(path))
+            for url, (filename, path) in downloads.items()
+        }
+        self.snapshots[name] = {
+            "config": config_hash,
+            "metadata": self.get_metadata_hash(name, scraper.get_reader()),
+            "inputs": inputs,
+        }
+        for key in ("datasetinfo", "headers", "values", "sources", "source_urls"):
+            self.snapshots[name][key] = deepcopy(getattr(scraper, key))
+
+    def save(self):
+        folder = dirname(self.path)
+        if folder:
+            makedirs(folder, exist_ok=True)
+        partial_path = f"{self.path}.part"
+        with open(partial_path, "wb") as f:
+            pickle.dump(self.snapshots, f)
+        replace(partial_path, self.path)
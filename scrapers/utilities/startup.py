@@ -0,0 +1,94 @@
+import logging
+import pickle
+from os import makedirs, replace
+from os.path import dirname, exists
+from time import time
+
+from hdx.location import __version__ as location_version
+from hdx.location.country import Country
+
+from .snapshots import get_hash
+
+logger = logging.getLogger(__name__)
+
+
+class StartupSnapshot:
+    """On disk snapshot of the parsed country data needed before any scraping starts
+    so that it is not downloaded and parsed on every run. Each part is keyed by a
+    hash of what it was built from along with the version of the location library,
+    and country data from the live feed is rebuilt once it is older than
+    countries_ttl. The whole snapshot is discarded if its format version changes. If
+    path is None, nothing is persisted.
+
+    Args:
+        path (Optional[str]): Path to snapshot file
+        countries_ttl (int): Seconds before country data is rebuilt. Defaults to 86400.
+    """
+
+    version = 1
+
+    def __init__(self, path, countries_ttl=86400):
+        self.path = path
+        self.countries_ttl = countries_ttl
+        self.snapshot = {"version": self.version}
+        self.changed = False
+        if path and exists(path):
+            with open(path, "rb") as f:
+                snapshot = pickle.load(f)
+            if snapshot.get("version") == self.version:
+                self.snapshot = snapshot
+            else:
+                logger.info(f"Ignoring {path} from a different version")
+
+    def get(self, part, key):
+        entry = self.snapshot.get(part)
+        if entry is None or entry["key"] != key:
+            return None
+        return entry
+
+    def set(self, part, key, data):
+        self.snapshot[part] = {"key": key, "created": time(), "data": data}
+        self.changed = True
+
+    def setup_countries(
+        self, use_live=True, country_name_overrides=None, country_name_mappings=None
+    ):
+        """Set up Country as Country.countriesdata would but from the snapshot if
+        possible"""
+        if Country._countriesdata is not None:
+            return
+        key = get_hash(
+            {
+                "location_version": location_version,
+                "use_live": use_live,
+                "country_name_overrides": country_name_overrides,
+                "country_name_mappings": country_name_mappings,
+            }
+        )
+        entry = self.get("countries", key)
+        if entry and (not use_live or time() - entry["created"] < self.countries_ttl):
+            if country_name_overrides is not None:
+                Country.set_country_name_overrides(country_name_overrides)
+            if country_name_mappings is not None:
+                Country.set_country_name_mappings(country_name_mappings)
+            Country._countriesdata = entry["data"]
+            logger.info("Using country data from startup snapshot")
+            return
+        Country.countriesdata(
+            use_live=use_live,
+            country_name_overrides=country_name_overrides,
+            country_name_mappings=country_name_mappings,
+        )
+        self.set("countries", key, Country._countriesdata)
+
+    def save(self):
+        if not self.path or not self.changed:
+            return
+        folder = dirname(self.path)
+        if folder:
+            makedirs(folder, exist_ok=True)
+        partial_path = f"{self.path}.part"
+        with open(partial_path, "wb") as f:
+            pickle.dump(self.snapshot, f)
+        replace(partial_path, self.path)
+        self.changed = False
@@ -1,16 +1,28 @@
 import filecmp
-from os.path import join
+import pickle
+from os.path import exists, join
 
 import pytest
+import run
 from hdx.api.configuration import Configuration
-from hdx.scraper.outputs.base import BaseOutput
-from hdx.scraper.outputs.json import JsonFile
-from hdx.scraper.utilities.reader import Read
+from hdx.location.country import Country
+from hdx.scraper.configurable import scraper
 from hdx.utilities.dateparse import parse_date
 from hdx.utilities.errors_onexit import ErrorsOnExit
+from hdx.utilities.loader import load_json
 from hdx.utilities.path import temp_dir
 from hdx.utilities.useragent import UserAgent
+from openpyxl import load_workbook
+from scrapers.acled import ACLED, FatalitiesRollup, filter_dates, hxltags
 from scrapers.main import get_indicators
+from scrapers.outputs.base import BaseOutput
+from scrapers.outputs.dispatcher import OutputDispatcher
+from scrapers.outputs.json import JsonFile, load_json_output
+from scrapers.utilities.acled_store import ACLEDStore
+from scrapers.utilities.expressions import compile_expression
+from scrapers.utilities.httpcache import CachedRead
+from scrapers.utilities.instrumentation import RunMetrics
+from scrapers.utilities.profiles import get_profile_configuration
 
 
 class TestHornAfrica:
@@ -28,36 +40,288 @@ class TestHornAfrica:
     def folder(self):
         return join("tests", "fixtures")
 
-    def test_get_indicators(self, configuration, folder):
+    def check_get_indicators(
+        self,
+        configuration,
+        folder,
+        temp_folder,
+        metrics=None,
+        parse_workers=0,
+        **kwargs,
+    ):
+        today = parse_date("2022-09-05")
+        CachedRead.create_readers(
+            temp_folder,
+            join(folder, "input"),
+            temp_folder,
+            save=False,
+            use_saved=True,
+            today=today,
+            metrics=metrics,
+            parse_workers=parse_workers,
+        )
+        tabs = configuration["tabs"]
+        noout = BaseOutput(tabs)
+        jsonout = JsonFile(configuration["json"], tabs)
         with ErrorsOnExit() as errors_on_exit:
-            with temp_dir(
-                "TestHornAfricaViz", delete_on_success=True, delete_on_failure=False
-            ) as temp_folder:
-                today = parse_date("2022-09-05")
-                Read.create_readers(
-                    temp_folder,
-                    join(folder, "input"),
-                    temp_folder,
-                    save=False,
-                    use_saved=True,
-                    today=today,
-                )
-                tabs = configuration["tabs"]
-                noout = BaseOutput(tabs)
-                jsonout = JsonFile(configuration["json"], tabs)
-                outputs = {"gsheets": noout, "excel": noout, "json": jsonout}
-                countries_to_save = get_indicators(
+            outputs = OutputDispatcher(
+                {"gsheets": noout, "excel": noout, "json": jsonout},
+                errors_on_exit=errors_on_exit,
+                metrics=metrics,
+            )
+            countries_to_save = get_indicators(
+                configuration,
+                today,
+                outputs,
+                tabs,
+                scrapers_to_run=None,
+                countries_override=None,
+                errors_on_exit=errors_on_exit,
+                use_live=False,
+                metrics=metrics,
+                **kwargs,
+            )
+            outputs.close()
+        CachedRead.parse_pool.close()
+        filepaths = jsonout.save(folder=temp_folder, countries_to_save=countries_to_save)
+        filename = configuration["json"]["output"]
+        assert filecmp.cmp(filepaths[0], join(folder, filename))
+
+    def test_get_indicators(self, configuration, folder):
+        with temp_dir(
+            "TestHornAfricaViz", delete_on_success=True, delete_on_failure=False
+        ) as temp_folder:
+            metrics = RunMetrics()
+            self.check_get_indicators(
+                configuration, folder, temp_folder, metrics, parse_workers=2
+            )
+            report_path = join(temp_folder, "report.json")
+            prometheus_path = join(temp_folder, "metrics.prom")
+            metrics.save(report_path, prometheus_path)
+            report = load_json(report_path)
+            fts = report["scrapers"]["fts"]
+            assert fts["calls"] == 1
+            assert fts["rows_out"] == 3
+            assert report["sources"]["idps_kenya"]["rows_in"] == 6
+            # Only rows that pass the prefilter come back from the parse pool
+            assert report["sources"]["idps_somalia"]["rows_in"] == 14462
+            # The CHIRPS table is read once by whichever scraper runs first and
+            # shared with the other
+            sources = report["sources"]
+            chirps = [sources["chirps_current"], sources["chirps_previous"]]
+            assert {"cache_hits": 1} in chirps
+            assert report["outputs"]["json.update_tab"]["rows_out"] == 1375
+            with open(prometheus_path) as f:
+                assert 'hornafrica_viz_scraper_calls{scraper="fts"} 1\n' in f.read()
+
+    def test_get_indicators_cached(self, configuration, folder):
+        with temp_dir(
+            "TestHornAfricaVizCached", delete_on_success=True, delete_on_failure=False
+        ) as temp_folder:
+            cache_folder = join(temp_folder, "cache")
+            # The first run fills the caches and the second run reads from them
+            for _ in range(2):
+                # Make the second run set up country data from the startup snapshot
+                Country._countriesdata = None
+                self.check_get_indicators(
                     configuration,
-                    today,
-                    outputs,
-                    tabs,
-                    scrapers_to_run=None,
-                    countries_override=None,
-                    errors_on_exit=errors_on_exit,
-                    use_live=False,
-                )
-                filepaths = jsonout.save(
-                    folder=temp_folder, countries_to_save=countries_to_save
+                    folder,
+                    temp_folder,
+                    cache_folder=cache_folder,
+                    skip_unchanged=True,
                 )
-                filename = configuration["json"]["output"]
-                assert filecmp.cmp(filepaths[0], join(folder, filename))
+            # Scrapers reading shared tables are snapshotted too and the tables are
+            # released by those that are restored
+            with open(join(cache_folder, "scraper_snapshots.pkl"), "rb") as f:
+                snapshots = pickle.load(f)
+            for name in (
+                "population_eth_national",
+                "population_ken_national",
+                "population_som_national",
+                "chirps_current_admintwo",
+                "chirps_previous_admintwo",
+            ):
+                assert name in snapshots
+            assert CachedRead.tables == {}
+            fts_cache = load_json(join(cache_folder, "fts_cache.json"))
+            assert len(fts_cache["plans"]) != 0
+            # The gazetteer index is compiled into the cache folder not the source
+            assert exists(join(cache_folder, "admin2_gazetteer.pkl"))
+            assert not exists(join("config", "admin2_gazetteer.pkl"))
+
+    def test_compact_json(self, configuration, folder):
+        with temp_dir(
+            "TestHornAfricaVizCompact", delete_on_success=True, delete_on_failure=False
+        ) as temp_folder:
+            expected = load_json(join(folder, configuration["json"]["output"]))
+            jsonout = JsonFile(configuration["json"], configuration["tabs"], True)
+            jsonout.json = expected
+            filepaths = jsonout.save(folder=temp_folder)
+            assert load_json_output(filepaths[0]) == expected
+            filepath = join(temp_folder, "all_fatalities.json")
+            assert load_json_output(filepath) == {
+                "fatalities_data": expected["fatalities_data"]
+            }
+            assert f"{filepath}.gz" in filepaths
+
+    def test_get_profile_configuration(self, configuration):
+        configuration["profiles"]["sahel"] = {
+            "countries": ["BFA", "MLI", "NER"],
+            "json": {"output": "sahel.json"},
+        }
+        profile_configuration = get_profile_configuration(configuration, "sahel")
+        assert profile_configuration["countries"] == ["BFA", "MLI", "NER"]
+        assert profile_configuration["json"]["output"] == "sahel.json"
+        assert profile_configuration["json"]["compact"] == {
+            "split": True,
+            "compress": ["gzip"],
+        }
+        assert configuration["countries"] == ["ETH", "KEN", "SOM"]
+        assert configuration["json"]["output"] == "all.json"
+        # Profiles that do not set their outputs get their own
+        profile_configuration = get_profile_configuration(configuration, "hornafrica")
+        assert profile_configuration["json"]["output"] == "all_hornafrica.json"
+        assert profile_configuration["googlesheets"] == {}
+
+    def test_profiles(self, configuration, monkeypatch):
+        configuration["profiles"] = {
+            "horn": {"countries": ["ETH", "SOM"]},
+            "kenya": {"countries": ["KEN"]},
+        }
+
+        def get_indicators(configuration, today, outputs, *args, **kwargs):
+            countries = [[",".join(configuration["countries"])]]
+            for output in outputs.values():
+                output.update_tab("regional", [["value"], ["#value"]] + countries)
+            return configuration["countries"]
+
+        monkeypatch.setattr(run, "get_indicators", get_indicators)
+        kwargs = {
+            "gsheet_auth": None,
+            "gsheet_diff": False,
+            "updatesheets": None,
+            "updatetabs": ["regional"],
+            "scrapers_to_run": None,
+            "header_auths": None,
+            "basic_auths": None,
+            "param_auths": None,
+            "nojson": False,
+            "compact_json": False,
+            "countries_override": None,
+            "save": False,
+            "use_saved": False,
+            "cache_folder": None,
+            "acled_rebuild": False,
+            "skip_unchanged": False,
+            "profiles": ["horn", "kenya"],
+        }
+        with temp_dir(
+            "TestHornAfricaVizProfiles", delete_on_success=True, delete_on_failure=False
+        ) as temp_folder:
+            monkeypatch.chdir(temp_folder)
+            run.main(join(temp_folder, "output.xlsx"), **kwargs)
+            # Each profile writes its own outputs
+            for profile, countries in (("horn", "ETH,SOM"), ("kenya", "KEN")):
+                output = load_json(f"all_{profile}.json")
+                assert output["regional_data"] == [{"#value": countries}]
+                workbook = load_workbook(join(temp_folder, f"output_{profile}.xlsx"))
+                tab = workbook[configuration["tabs"]["regional"]]
+                assert tab["A3"].value == countries
+            assert not exists("all.json")
+        # Profiles cannot share spreadsheets
+        kwargs["gsheet_auth"] = "{}"
+        with pytest.raises(ValueError):
+            run.main(None, **kwargs)
+        kwargs["gsheet_auth"] = None
+
+        def fail(configuration, *args, **kwargs):
+            if configuration["countries"] == ["KEN"]:
+                raise RuntimeError("profile failed")
+            return get_indicators(configuration, *args, **kwargs)
+
+        monkeypatch.setattr(run, "get_indicators", fail)
+        with temp_dir(
+            "TestHornAfricaVizProfilesFail",
+            delete_on_success=True,
+            delete_on_failure=False,
+        ) as temp_folder:
+            monkeypatch.chdir(temp_folder)
+            report_path = join(temp_folder, "report.json")
+            with pytest.raises(RuntimeError):
+                run.main(None, run_report=report_path, **kwargs)
+            # The parse workers are shut down and the metrics saved regardless
+            assert CachedRead.parse_pool.executor is None
+            assert "horn" in load_json(report_path)["profiles"]
+
+    def test_compile_expression(self):
+        function = compile_expression("row['Season'] == 'octdec'", "row", scraper)
+        assert function({"Season": "octdec"}) is True
+        assert function({"Season": "marmay"}) is False
+        function = compile_expression("get_numeric_if_possible(val)", "val", scraper)
+        assert function("1,234") == 1234
+        function = compile_expression(
+            "'drought' in row['Reason'].lower() and row['Year Week'] >= 202100",
+            "row",
+            scraper,
+        )
+        assert function({"Reason": "Drought related", "Year Week": 202150}) is True
+        assert function({"Reason": "Conflict", "Year Week": 202150}) is False
+
+    def test_filter_dates(self):
+        dates = ["2021-12-31", "2022-03-01", "15 February 2022", "2022-01-01"]
+        keep, latest_date = filter_dates(dates, parse_date("2022-01-01"))
+        assert keep == [False, True, True, True]
+        assert latest_date == parse_date("2022-03-01")
+        keep, latest_date = filter_dates(dates[:1], parse_date("2022-01-01"))
+        assert keep == [False]
+        assert latest_date is None
+
+    def test_acled_events(self, configuration, monkeypatch):
+        datasetinfo = {"start_date": "2022-01-01", "raw_events_days": 10}
+        acled = ACLED(datasetinfo, parse_date("2022-03-20"), ["SOM"], {}, None)
+        monkeypatch.setattr(
+            acled, "get_row", lambda inrow, _: [inrow.get(x) for x in hxltags]
+        )
+        with temp_dir("TestACLEDEvents") as folder:
+            path = join(folder, "events.csv")
+            with open(path, "w") as f:
+                f.write("event_id_cnty,event_date,event_type,fatalities\n")
+                f.write("S1,2022-03-01,Battles,1\n")
+                f.write("S2,15 March 2022,Battles,2\n")
+                f.write("S3,31 December 2021,Battles,4\n")
+            latest_dates = list()
+            events = list(acled.read_events([path], acled.start_date, latest_dates))
+        # Dates not in YYYY-MM-DD format are normalised
+        assert [(x[0], x[1][0]) for x in events] == [
+            ("S1", "2022-03-01"),
+            ("S2", "2022-03-15"),
+        ]
+        assert latest_dates == [parse_date("2022-03-15")]
+        rollup = FatalitiesRollup(["SOM"])
+        rows = list(acled.iter_rows((("SOM", x[1]) for x in events), rollup))
+        assert [row[0] for row in rows[2:]] == ["2022-03-15"]
+        assert rollup.get_rows()[2:] == [
+            [None, None, "Battles", "2022-03", 3, 2],
+            ["SOM", None, "Battles", "2022-03", 3, 2],
+        ]
+
+    def test_acled_dates(self):
+        with temp_dir("TestACLEDDates") as folder:
+            store = ACLEDStore(join(folder, "acled.jsonl"))
+            store.replace_group("SOM", 2022, [("S1", ["2022-08-30"])])
+            store.update_watermark("SOM", parse_date("2022-08-30"))
+            store.update_start_date("SOM", parse_date("2022-01-01"))
+            datasetinfo = {"start_date": "2021-01-01", "overlap_days": 14}
+            acled = ACLED(
+                datasetinfo, parse_date("2023-02-01"), ["SOM", "KEN"], {}, None, store
+            )
+            # Events from before those stored are fetched for whole years while the
+            # stored events are refetched from some days before the latest of them
+            assert acled.get_years("SOM") == [2021, 2022, 2023]
+            for year in (2021, 2022, 2023):
+                start_date = parse_date(f"{year}-01-01")
+                assert acled.get_start_date(year, "SOM") == (start_date, False)
+            assert list(acled.get_years("KEN")) == [2021, 2022, 2023]
+            store.update_start_date("SOM", parse_date("2021-01-01"))
+            assert acled.get_years("SOM") == [2022, 2023]
+            assert acled.get_start_date(2022, "SOM") == (parse_date("2022-08-16"), True)
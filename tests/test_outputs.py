@@ -0,0 +1,370 @@
+import re
+from os.path import join
+from types import SimpleNamespace
+
+import gspread
+import pytest
+import run
+from gspread.exceptions import APIError, WorksheetNotFound
+from hdx.utilities.errors_onexit import ErrorsOnExit
+from hdx.utilities.path import temp_dir
+from openpyxl import load_workbook
+from scrapers.outputs.base import BaseOutput
+from scrapers.outputs.chunks import update_tab_in_chunks
+from scrapers.outputs.dispatcher import OutputDispatcher
+from scrapers.outputs import googlesheets
+from scrapers.outputs.excelfile import ExcelFile
+from scrapers.outputs.googlesheets import GoogleSheets, get_changed_rows
+from scrapers.outputs.json import JsonFile, SpooledRows
+
+
+class FakeWorksheet:
+    def __init__(self, title, rows=None, no_rows=1000, no_cols=26):
+        self.title = title
+        self.rows = rows or list()
+        self.row_count = no_rows
+        self.col_count = no_cols
+        self.errors = list()
+
+    def clear(self):
+        self.rows = list()
+
+    def update(self, range_name, values):
+        assert range_name == "A1"
+        self.rows = [list(row) for row in values]
+
+    def append_rows(self, values, value_input_option):
+        if self.errors:
+            raise self.errors.pop(0)
+        self.rows.extend(list(row) for row in values)
+
+    def resize(self, no_rows, no_cols):
+        self.row_count = no_rows
+        self.col_count = no_cols
+
+    def write(self, row_number, rows):
+        self.rows.extend([] for _ in range(row_number - 1 + len(rows) - len(self.rows)))
+        for i, row in enumerate(rows):
+            self.rows[row_number - 1 + i] = list(row)
+
+
+class FakeSpreadsheet:
+    def __init__(self, title, worksheets):
+        self.title = title
+        self.tabs = {worksheet.title: worksheet for worksheet in worksheets}
+        self.requests = list()
+
+    def worksheet(self, title):
+        if title not in self.tabs:
+            raise WorksheetNotFound(title)
+        return self.tabs[title]
+
+    def worksheets(self):
+        return list(self.tabs.values())
+
+    def add_worksheet(self, title, rows, cols):
+        self.tabs[title] = FakeWorksheet(title, no_rows=rows, no_cols=cols)
+        return self.tabs[title]
+
+    def values_batch_get(self, ranges, params):
+        value_ranges = list()
+        for valuerange in ranges:
+            rows = self.tabs[valuerange[1:-1].replace("''", "'")].rows
+            value_ranges.append({"values": rows} if rows else dict())
+        return {"valueRanges": value_ranges}
+
+    def values_batch_update(self, body):
+        self.requests.append(body["data"])
+        for data in body["data"]:
+            title, row_number = re.fullmatch(r"'(.*)'!A(\d+)", data["range"]).groups()
+            title = title.replace("''", "'")
+            self.tabs[title].write(int(row_number), data["values"])
+
+
+class FakeClient:
+    def __init__(self, spreadsheets):
+        self.spreadsheets = spreadsheets
+
+    def open_by_url(self, url):
+        return self.spreadsheets[url]
+
+
+def get_api_error(code):
+    error = {"code": code, "message": "Error", "status": "ERROR"}
+    return APIError(SimpleNamespace(json=lambda: {"error": error}))
+
+
+def get_values(rows):
+    """Rows as they would be read back from a sheet, without trailing blanks"""
+    rows = [list(row) for row in rows]
+    for row in rows:
+        while row and row[-1] in ("", None):
+            row.pop()
+    while rows and not rows[-1]:
+        rows.pop()
+    return rows
+
+
+class FlakyOutput(BaseOutput):
+    """Output that fails in turn in the ways given for each tab (None to succeed)"""
+
+    def __init__(self, failures):
+        super().__init__(list(failures))
+        self.failures = failures
+        self.tabs = dict()
+
+    def fail(self, tabname):
+        failures = self.failures[tabname]
+        if failures:
+            failure = failures.pop(0)
+            if failure:
+                raise failure
+
+    def update_tab(self, tabname, values, hxltags=None):
+        self.fail(tabname)
+        self.tabs[tabname] = list(values)
+
+    def append_tab(self, tabname, values):
+        self.fail(tabname)
+        self.tabs[tabname].extend(values[2:])
+
+
+class TestOutputs:
+    @pytest.fixture(scope="function")
+    def spreadsheet(self, monkeypatch):
+        spreadsheet = FakeSpreadsheet("prod", [FakeWorksheet("RegionalData")])
+        client = FakeClient({"https://prod": spreadsheet})
+        monkeypatch.setattr(
+            gspread, "service_account_from_dict", lambda info, scopes: client
+        )
+        return spreadsheet
+
+    def get_gsheets(self, tabs=None, **kwargs):
+        if tabs is None:
+            tabs = {"fatalitiesrollup": "FatalitiesRollup", "regional": "RegionalData"}
+        return GoogleSheets(
+            {"prod": "https://prod"}, "{}", None, tabs, list(tabs), **kwargs
+        )
+
+    @pytest.mark.parametrize(
+        "published,values,expected",
+        [
+            # Unchanged, where None is published as a blank cell
+            ([["a", 1], ["b", ""]], [["a", 1], ["b", None]], []),
+            # Changed
+            ([["a", 1], ["b", 2]], [["a", 1], ["b", 3]], [(2, [["b", 3]])]),
+            # Inserted at the end
+            ([["a", 1]], [["a", 1], ["b", 2]], [(2, [["b", 2]])]),
+            # Inserted in the middle so the rows after it move down
+            (
+                [["a", 1], ["c", 3]],
+                [["a", 1], ["b", 2], ["c", 3]],
+                [(2, [["b", 2], ["c", 3]])],
+            ),
+            # Removed from the middle so the rows after it move up and the last
+            # row is blanked
+            (
+                [["a", 1], ["b", 2], ["c", 3], ["d", 4]],
+                [["a", 1], ["c", 3], ["d", 4]],
+                [(2, [["c", 3], ["d", 4], ["", ""]])],
+            ),
+            # Shrunk in both directions
+            (
+                [["a", 1, "x"], ["b", 2]],
+                [["a", 1]],
+                [(1, [["a", 1, ""], ["", "", ""]])],
+            ),
+            # Changed in two separate blocks
+            (
+                [["a"], ["b"], ["c"], ["d"]],
+                [["x"], ["b"], ["c"], ["y"]],
+                [(1, [["x"]]), (4, [["y"]])],
+            ),
+        ],
+    )
+    def test_get_changed_rows(self, published, values, expected):
+        assert get_changed_rows(published, values) == expected
+
+    def test_get_batches(self, spreadsheet):
+        gsheets = self.get_gsheets(diff=True, max_cells=4)
+        changes = [
+            ("A", 1, [["a", 1], ["b", 2], ["c", 3]]),
+            ("B", 5, [["d", 4, "x"]]),
+        ]
+        assert gsheets.get_batches(changes) == [
+            [{"range": "'A'!A1", "values": [["a", 1], ["b", 2]]}],
+            [{"range": "'A'!A3", "values": [["c", 3]]}],
+            [{"range": "'B'!A5", "values": [["d", 4, "x"]]}],
+        ]
+
+    @pytest.mark.parametrize(
+        "published,values",
+        [
+            ([], [["a", 1], ["b", 2]]),
+            ([["a", 1], ["b", 2], ["c", 3]], [["a", 1], ["c", 4]]),
+            ([["a", 1, "x"], ["b", 2, "y"]], [["b", 2]]),
+            ([["a"]] * 5, [["a"], ["b"], ["a"], ["a"], ["a"], ["c", 1]]),
+        ],
+    )
+    def test_update_spreadsheet(self, spreadsheet, published, values):
+        spreadsheet.tabs["RegionalData"].rows = [list(row) for row in published]
+        gsheets = self.get_gsheets(diff=True, max_cells=3)
+        gsheets.update_tab("regional", values)
+        gsheets.save()
+        assert get_values(spreadsheet.tabs["RegionalData"].rows) == values
+        # Only changed rows are sent, no more than 3 cells at a time
+        data = [x["values"] for request in spreadsheet.requests for x in request]
+        assert all(len(rows) * len(rows[0]) <= 3 for rows in data)
+        changes = get_changed_rows(published, values)
+        assert sum(len(rows) for rows in data) == sum(len(x[1]) for x in changes)
+
+    def test_gsheets_backoff(self, spreadsheet, monkeypatch):
+        waits = list()
+        monkeypatch.setattr(googlesheets, "sleep", waits.append)
+        worksheet = spreadsheet.tabs["RegionalData"]
+        worksheet.errors = [get_api_error(503), get_api_error(429)]
+        gsheets = self.get_gsheets()
+        values = [["value"], ["#value"], [1], [2]]
+        gsheets.update_tab("regional", values[:3])
+        gsheets.append_tab("regional", values[:2] + values[3:])
+        assert worksheet.rows == values
+        assert len(waits) == 2
+        worksheet.errors = [get_api_error(400)]
+        with pytest.raises(APIError):
+            gsheets.append_tab("regional", values)
+
+    def test_gsheets_quoted_title(self, spreadsheet):
+        gsheets = self.get_gsheets(tabs={"regional": "Region's Data"}, diff=True)
+        assert gsheets.get_batches([("Region's Data", 3, [["a"]])]) == [
+            [{"range": "'Region''s Data'!A3", "values": [["a"]]}]
+        ]
+        values = [["value"], ["#value"], [1]]
+        gsheets.update_tab("regional", values)
+        gsheets.save()
+        assert spreadsheet.tabs["Region's Data"].rows == values
+
+    def test_gsheets_diff_chunks(self, spreadsheet):
+        gsheets = self.get_gsheets(diff=True)
+        rows = [["value"], ["#value"]] + [[i] for i in range(5)]
+        update_tab_in_chunks({"gsheets": gsheets}, "regional", rows, 2)
+        # Tabs written in chunks are not held until save
+        assert gsheets.pending == {}
+        assert spreadsheet.tabs["RegionalData"].rows == rows
+        gsheets.save()
+        assert spreadsheet.requests == []
+        # Appending without an update first appends as in normal mode
+        gsheets.append_tab("fatalitiesrollup", [["month"], ["#date+month"], ["x"]])
+        assert spreadsheet.tabs["FatalitiesRollup"].rows == [["x"]]
+
+    @pytest.mark.parametrize("diff", [False, True])
+    def test_gsheets_missing_tab(self, spreadsheet, diff):
+        rollup = [["month", "events"], ["#date+month", "#event+num"], ["2022-09", 3]]
+        regional = [["value"], ["#value"], [1]]
+        outputs = OutputDispatcher({"gsheets": self.get_gsheets(diff=diff)})
+        outputs["gsheets"].update_tab("fatalitiesrollup", rollup)
+        outputs["gsheets"].update_tab("regional", regional)
+        outputs["gsheets"].save()
+        outputs.close()
+        # The missing tab is added and later tabs are still updated
+        assert spreadsheet.tabs["FatalitiesRollup"].rows == rollup
+        assert spreadsheet.tabs["RegionalData"].rows == regional
+
+    def test_dispatcher_failures(self):
+        output = FlakyOutput(
+            {
+                "fatalities": [ValueError("bad")],
+                "regional": [ConnectionError("reset"), TimeoutError("slow")],
+                "national": [None, TimeoutError("slow")],
+            }
+        )
+        headers = [["value"], ["#value"]]
+        with pytest.raises(SystemExit):
+            with ErrorsOnExit() as errors_on_exit:
+                outputs = OutputDispatcher(
+                    {"flaky": output}, errors_on_exit=errors_on_exit, retry_wait=0
+                )
+                outputs["flaky"].update_tab("fatalities", headers + [[1]])
+                outputs["flaky"].append_tab("fatalities", headers + [[2]])
+                outputs["flaky"].update_tab("regional", headers + [[3]])
+                outputs["flaky"].update_tab("national", headers + [[4]])
+                outputs["flaky"].append_tab("national", headers + [[5]])
+                outputs["flaky"].append_tab("national", headers + [[6]])
+                outputs.close()
+                # Only the failed tab is dropped and transient errors are retried
+                assert "fatalities" not in output.tabs
+                assert output.tabs["regional"] == headers + [[3]]
+                # but not for appends which may have been applied, so the tab fails
+                assert output.tabs["national"] == headers + [[4]]
+                assert len(errors_on_exit.errors) == 2
+                assert "failed in update_tab" in errors_on_exit.errors[0]
+                assert "failed in append_tab" in errors_on_exit.errors[1]
+
+    def test_outputs_closed_on_error(self, monkeypatch):
+        dispatchers = list()
+
+        def create_dispatcher(*args, **kwargs):
+            dispatchers.append(OutputDispatcher(*args, **kwargs))
+            return dispatchers[-1]
+
+        def get_indicators(*args, **kwargs):
+            raise RuntimeError("scraper failed")
+
+        monkeypatch.setattr(run, "OutputDispatcher", create_dispatcher)
+        monkeypatch.setattr(run, "get_indicators", get_indicators)
+        configuration = {"tabs": {"regional": "RegionalData"}, "outputs": dict()}
+        with pytest.raises(RuntimeError):
+            run.run_profile(
+                configuration,
+                today=None,
+                excel_path=None,
+                gsheet_auth=None,
+                gsheet_diff=False,
+                updatesheets=None,
+                updatetabs=None,
+                scrapers_to_run=None,
+                nojson=True,
+                compact_json=False,
+                countries_override=None,
+                errors_on_exit=None,
+                cache_folder=None,
+                acled_rebuild=False,
+                skip_unchanged=False,
+                metrics=None,
+            )
+        assert not any(x.thread.is_alive() for x in dispatchers[0].values())
+
+    def test_chunked_outputs(self):
+        tabs = {"fatalities": "Fatalities", "regional": "RegionalData"}
+        rows = [["date", "location"], ["#date", "#loc+name"]]
+        for i in range(25):
+            rows.append([f"2022-09-{i + 1:02d}", "Ādīs" if i % 3 else "Bur Hakaba"])
+        rows[5][1] = None
+        with temp_dir("TestChunkedOutputs") as folder:
+            contents = list()
+            for chunk_size in (10, 100):
+                configuration = {"output": join(folder, f"{chunk_size}.json")}
+                jsonout = JsonFile(configuration, list(tabs))
+                configuration = {
+                    "output": join(folder, f"{chunk_size}_compact.json"),
+                    "compact": dict(),
+                }
+                compactout = JsonFile(configuration, list(tabs), compact=True)
+                excel_path = join(folder, f"{chunk_size}.xlsx")
+                excelout = ExcelFile(excel_path, tabs, list(tabs))
+                outputs = {"json": jsonout, "compact": compactout, "excel": excelout}
+                for output in outputs.values():
+                    output.update_tab("regional", [["value"], ["#value"], [1]])
+                update_tab_in_chunks(outputs, "fatalities", rows, chunk_size)
+                # Appended rows are spooled to disk
+                spooled = isinstance(jsonout.json["fatalities_data"], SpooledRows)
+                assert spooled is (chunk_size == 10)
+                paths = jsonout.save() + compactout.save()
+                excelout.save()
+                workbook = load_workbook(excel_path)
+                assert workbook.sheetnames == ["Fatalities", "RegionalData"]
+                assert list(workbook["Fatalities"].values) == [tuple(x) for x in rows]
+                contents.append(list())
+                for path in paths:
+                    with open(path, encoding="utf-8") as f:
+                        contents[-1].append(f.read())
+            assert contents[0] == contents[1]
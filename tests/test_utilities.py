@@ -0,0 +1,310 @@
+from copy import deepcopy
+from itertools import count
+from os import listdir
+from os.path import join
+from time import perf_counter
+from types import SimpleNamespace
+
+import pytest
+from hdx.scraper.runner import Runner
+from hdx.scraper.utilities.reader import Read
+from hdx.utilities.dateparse import parse_date
+from hdx.utilities.downloader import Download
+from hdx.utilities.path import temp_dir
+from hdx.utilities.useragent import UserAgent
+from scrapers.utilities.acled_store import ACLEDStore
+from scrapers.utilities.configurable import CompiledConfigurableScraper, CompiledRunner
+from scrapers.utilities.instrumentation import RunMetrics
+from scrapers.utilities.parsing import ParsePool, get_prefilter
+from scrapers.utilities import httpcache
+from scrapers.utilities.httpcache import HTTPCache
+from scrapers.utilities.parallel import clone_reader
+
+
+class FakeDownloader:
+    """Downloader of files given as a mapping from URL to contents, ETag and
+    Last-Modified that answers conditional requests as a server would"""
+
+    def __init__(self, files):
+        self.files = files
+        self.requests = list()
+        self.paths = list()
+
+    def setup(self, url, headers, **kwargs):
+        self.requests.append((url, headers))
+        self.url = url
+        _, etag, last_modified = self.files[url]
+        if "If-None-Match" in headers:
+            unchanged = headers["If-None-Match"] == etag
+        else:
+            unchanged = headers.get("If-Modified-Since", False) == last_modified
+        self.status = 304 if unchanged else 200
+        self.response = SimpleNamespace(close=lambda: None)
+
+    def get_status(self):
+        return self.status
+
+    def get_header(self, header):
+        _, etag, last_modified = self.files[self.url]
+        return {"ETag": etag, "Last-Modified": last_modified}[header]
+
+    def stream_path(self, path, errormsg):
+        self.paths.append(path)
+        with open(path, "w") as f:
+            f.write(self.files[self.url][0])
+        return path
+
+
+class TestUtilities:
+    def test_clone_reader(self, monkeypatch):
+        calls = list()
+        monkeypatch.setattr(
+            Download,
+            "normal_setup",
+            lambda self, url, **kwargs: calls.append(perf_counter()),
+        )
+        with temp_dir("TestCloneReader") as folder:
+            downloader = Download(
+                user_agent="test", rate_limit={"calls": 1, "period": 0.2}
+            )
+            reader = Read(downloader, folder, folder, folder, delete=False)
+            clone = clone_reader(reader)
+            clones_clone = clone_reader(clone)
+            for reader in (reader, clone, clones_clone, clone):
+                reader.downloader.setup("https://example.com")
+        # The clones share the rate limit of the reader they are cloned from
+        assert len(calls) == 4
+        assert calls[-1] - calls[0] >= 0.55
+
+    def test_http_cache(self, monkeypatch):
+        monkeypatch.setattr(httpcache, "time", count().__next__)
+        files = {
+            "https://a": ("aaaaaa", '"a1"', None),
+            "https://b": ("bbbbbb", None, "Mon, 05 Sep 2022 00:00:00 GMT"),
+        }
+        downloader = FakeDownloader(files)
+        with temp_dir("TestHTTPCache") as folder:
+            cache = HTTPCache(folder, ttls={"daily": 86400})
+
+            def download(url, name="daily"):
+                path, status = cache.download(downloader, url, "a.csv", name)
+                with open(path) as f:
+                    return f.read(), status
+
+            assert download("https://a") == ("aaaaaa", "miss")
+            # Within the TTL, no request is made
+            assert download("https://a") == ("aaaaaa", "hit")
+            assert len(downloader.requests) == 1
+            # Otherwise the cached file is revalidated with its ETag
+            assert download("https://a", "other") == ("aaaaaa", "revalidated")
+            assert downloader.requests[-1][1] == {"If-None-Match": '"a1"'}
+            files["https://a"] = ("aaaaaaa", '"a2"', None)
+            assert download("https://a", "other") == ("aaaaaaa", "miss")
+            # or its Last-Modified date if it has no ETag
+            assert download("https://b", "other") == ("bbbbbb", "miss")
+            assert download("https://b", "other") == ("bbbbbb", "revalidated")
+            assert downloader.requests[-1][1] == {
+                "If-Modified-Since": "Mon, 05 Sep 2022 00:00:00 GMT"
+            }
+            # The least recently used files are evicted to fit in max_size
+            cache.max_size = 10
+            assert download("https://a") == ("aaaaaaa", "hit")
+            cache.save()
+            assert list(HTTPCache(folder).entries) == ["https://a"]
+            assert "index.json" in listdir(folder)
+            assert len(listdir(folder)) == 2
+        # Every download of a URL streams to its own partial file
+        assert len(set(downloader.paths)) == len(downloader.paths) == 3
+
+    def test_acled_store(self):
+        def event(date, fatalities=0):
+            return [date, "Battles", fatalities]
+
+        with temp_dir("TestACLEDStore") as folder:
+            path = join(folder, "acled.jsonl")
+            store = ACLEDStore(path)
+            store.replace_group(
+                "SOM", 2022, [("S1", event("2022-03-01")), ("S2", event("2022-05-01"))]
+            )
+            store.replace_group("KEN", 2022, [("K1", event("2022-04-01"))])
+            store.replace_group("ETH", 2022, [("E1", event("2022-06-01"))])
+            store.update_watermark("SOM", parse_date("2022-05-01"))
+            store.update_watermark("ETH", parse_date("2022-06-01"))
+            store.update_start_date("SOM", parse_date("2022-01-01"))
+            store.save()
+            # Refetching from a date replaces only the events from then on
+            store.replace_group(
+                "SOM",
+                2022,
+                [("S2", event("2022-05-01", 3)), ("S3", event("2022-05-02"))],
+                parse_date("2022-04-20").date(),
+            )
+            assert list(store.get_rows(["SOM", "KEN"])) == [
+                ("SOM", event("2022-05-02")),
+                ("SOM", event("2022-05-01", 3)),
+                ("SOM", event("2022-03-01")),
+                ("KEN", event("2022-04-01")),
+            ]
+            # Replacing the whole group drops events no longer there
+            store.replace_group("KEN", 2022, [])
+            store.save()
+            # Only events from the start date are output and only the countries
+            # given count towards the latest date
+            store = ACLEDStore(path)
+            assert list(store.get_rows(["KEN", "SOM"], parse_date("2022-04-01"))) == [
+                ("SOM", event("2022-05-02")),
+                ("SOM", event("2022-05-01", 3)),
+            ]
+            assert store.get_latest_date(["SOM", "KEN"]) == parse_date("2022-05-01")
+            assert store.get_start_date("SOM") == parse_date("2022-01-01")
+            assert store.get_start_date("KEN") is None
+            # The log is appended to until it has more than twice the lines needed
+            # for the live events and is then compacted
+            with open(path) as f:
+                assert len(f.readlines()) == 6
+            store.replace_group("ETH", 2022, [("E1", event("2022-06-01"))])
+            store.save()
+            with open(path) as f:
+                assert len(f.readlines()) == 8
+            for _ in range(2):
+                store.replace_group("ETH", 2022, [("E1", event("2022-06-01"))])
+            store.save()
+            with open(path) as f:
+                assert len(f.readlines()) == 6
+            compacted = ACLEDStore(path)
+            assert compacted.events == store.events
+            assert compacted.watermarks == store.watermarks
+            assert compacted.start_dates == store.start_dates
+
+    @pytest.mark.parametrize(
+        "datasetinfo",
+        [
+            {
+                "filter_cols": ["Value"],
+                "prefilter": "Value != 'x'",
+                "input": ["Value", "Other", "Value"],
+                "transform": {"Value": "get_numeric_if_possible(Value) * 2"},
+                "input_ignore_vals": ["n/a"],
+                "output": ["a", "b", "c"],
+                "output_hxl": ["#a", "#b", "#c"],
+            },
+            {
+                "filter_cols": ["Value", "Other"],
+                "prefilter": "Value != 'x'",
+                "subsets": [
+                    {
+                        "filter": "Other == '1'",
+                        "input": ["Value"],
+                        "transform": {"Value": "get_numeric_if_possible(Value) * 2"},
+                        "output": ["a"],
+                        "output_hxl": ["#a"],
+                    },
+                    {
+                        "filter": "Other != '1'",
+                        "input": ["Value"],
+                        "transform": {"Value": "get_numeric_if_possible(Value) + 1"},
+                        "input_ignore_vals": ["n/a"],
+                        "output": ["b"],
+                        "output_hxl": ["#b"],
+                    },
+                ],
+            },
+        ],
+    )
+    def test_compiled_runner(self, datasetinfo):
+        UserAgent.set_global("test")
+        datasetinfo.update(
+            {"source": "Test", "url": "https://example.com", "admin": ["ISO3"]}
+        )
+        original = deepcopy(datasetinfo)
+        headers = ["ISO3", "Value", "Other"]
+        rows = [
+            ["ETH", "1,000", "1"],
+            ["KEN", "x", "2"],
+            ["KEN", "3", "3"],
+            ["SOM", "n/a", "4"],
+        ]
+        values = list()
+        # Compiled scrapers give the same values as the library's own
+        for runner_class in (Runner, CompiledRunner):
+            runner = runner_class(["ETH", "KEN", "SOM"], parse_date("2022-09-05"))
+            name = runner.add_configurable("test", datasetinfo, "national")
+            scraper = runner.get_scraper(name)
+            scraper.get_iterator = lambda name: (
+                headers,
+                (dict(zip(headers, row)) for row in rows),
+            )
+            scraper.run()
+            values.append(scraper.get_values("national"))
+        assert isinstance(scraper, CompiledConfigurableScraper)
+        assert values[0] == values[1]
+        assert values[0][0] in ({"ETH": 2000, "KEN": 6, "SOM": "n/a"}, {"ETH": 2000})
+        # The dataset information is left as it is
+        assert datasetinfo == original
+
+    def test_parse_pool(self):
+        datasetinfo = {
+            "date": "Year Week",
+            "input": ["Reason", "Value"],
+            "prefilter": "'drought' in Reason.lower() and Year Week >= '202100' "
+            "and Value is not None",
+        }
+        prefilter = get_prefilter(datasetinfo)
+        assert prefilter == (
+            "'drought' in row['Reason'].lower() and row['Year Week'] >= '202100' "
+            "and row['Value'] is not None"
+        )
+        assert get_prefilter({**datasetinfo, "use_hxl": True}) is None
+        with temp_dir("TestParsePool") as folder:
+            path = join(folder, "rows.csv")
+            with open(path, "w") as f:
+                f.write("Year Week,Reason,Value\n")
+                f.write("202150,Drought related,1\n")
+                f.write("202050,Drought related,2\n")
+                f.write("202150,Conflict,3\n")
+                f.write("202151,DROUGHT,4\n")
+            results = list()
+            # In the calling thread and in a worker process
+            for max_workers in (0, 1):
+                parse_pool = ParsePool(max_workers)
+                headers, rows = parse_pool.parse(path, False, 1, prefilter, dict())
+                results.append((headers, list(rows)))
+                parse_pool.close()
+        assert results[0] == results[1]
+        assert results[0] == (
+            ["Year Week", "Reason", "Value"],
+            [
+                {"Year Week": "202150", "Reason": "Drought related", "Value": "1"},
+                {"Year Week": "202151", "Reason": "DROUGHT", "Value": "4"},
+            ],
+        )
+
+    def test_run_metrics(self):
+        metrics = RunMetrics()
+        metrics.add("scrapers", "fts", calls=1)
+        metrics.profile = "sahel"
+        metrics.add("scrapers", "fts", calls=2)
+        with metrics.measure("outputs", "json.update_tab", rows_out=3):
+            metrics.profile = "horn"
+        metrics.add("sources", 'a "b"\\c\nd', rows_in=4)
+        report = metrics.get_report()
+        # Profiles are kept apart
+        assert report["scrapers"] == {"fts": {"calls": 1}}
+        sahel = report["profiles"]["sahel"]
+        assert sahel["scrapers"] == {"fts": {"calls": 2}}
+        # What is measured counts towards the profile it started in
+        assert sahel["outputs"]["json.update_tab"]["rows_out"] == 3
+        sources = report["profiles"]["horn"]["sources"]
+        assert sources == {'a "b"\\c\nd': {"rows_in": 4}}
+        lines = metrics.get_prometheus(report).splitlines()
+        assert 'hornafrica_viz_scraper_calls{scraper="fts"} 1' in lines
+        assert 'hornafrica_viz_scraper_calls{profile="sahel",scraper="fts"} 2' in lines
+        assert (
+            'hornafrica_viz_output_rows_out{profile="sahel",output="json",'
+            'method="update_tab"} 3'
+        ) in lines
+        # Label values are escaped
+        assert (
+            'hornafrica_viz_source_rows_in{profile="horn",'
+            'source="a \\"b\\"\\\\c\\nd"} 4'
+        ) in lines